@@ -7,4 +7,28 @@
 __version__ = '1.0.0'
 
 
-from backtest.backtester import Backtester
+import importlib
+
+# Classes are imported on first use, so importing the package does not import matplotlib
+_MODULES = {'Backtester': 'backtest.backtester',
+            'Sweep': 'backtest.sweep',
+            'WalkForward': 'backtest.walkforward',
+            'Significance': 'backtest.significance',
+            'StreamingZScore': 'backtest.streaming',
+            'StreamingKalman': 'backtest.streaming',
+            'StreamingSignals': 'backtest.streaming'}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name: str):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_MODULES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted(list(globals()) + __all__)
@@ -1,50 +1,136 @@
 from research import Researcher
-from backtest.plot import Plotter
+from research import Instrumentation
+from research import ResultCache
+from backtest.engine import BacktestEngine
 from backtest import metrics
 from backtest import signals
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
+import time
+import os
 
 INITIAL_INVESTMENT = 10000
 
+_exporter = {}
+
+
+def _init_worker(hist_df: pd.DataFrame, researched_df: pd.DataFrame, settings: dict, max_points: int) -> None:
+    research = Researcher()
+    (research.hist_df, research.output_df) = (hist_df, researched_df)
+    backtester = Backtester(research)
+    backtester.edit_settings(**settings)
+    _exporter.update({'backtester': backtester, 'plotter': None, 'max_points': max_points})
+
+
+def _export_plot(currency1: str, currency2: str, path: str) -> str:
+    """
+    Saves the plots of a pair, drawing on the same headless figure for every pair of the process.
+    """
+    from backtest.plot import Plotter
+
+    backtester = _exporter['backtester']
+    pair_df = backtester.get_pair_df(currency1, currency2)
+
+    plotter = _exporter['plotter']
+    if plotter is None:
+        settings = backtester.get_settings()
+        plotter = _exporter['plotter'] = Plotter(pair_df, open_at=settings['open_at'], close_at=settings['close_at'],
+                                                 n_plots=5, max_points=_exporter['max_points'], headless=True)
+    else:
+        plotter.set_pair_df(pair_df)
+
+    plotter.set_currencies(currency1, currency2)
+    plotter.set_initial_investment(INITIAL_INVESTMENT)
+    plotter.plot_all()
+    plotter.save(path)
+    return path
+
 
 class Backtester:
 
-    def __init__(self, research: Researcher) -> None:
+    def __init__(self, research: Researcher, instrumentation: Instrumentation = None,
+                 cache: ResultCache = None) -> None:
+        """
+        :param instrumentation: records the timings, memory and cardinalities of the backtests, the
+        research one by default
+        :type: Instrumentation
+
+        :param cache: cached pair backtests, so only the pairs with new prices or settings run again,
+        the research one by default
+        :type: ResultCache
+        """
         self.hist_df = research.hist_df
+        self.instrumentation = instrumentation or getattr(research, 'instrumentation', Instrumentation(enabled=False))
         self.researched_df = research.output_df
         self.results_df = pd.DataFrame()
+        self.cache = cache or getattr(research, 'cache', None)
 
         self.__settings = {'open_at': 2,
-                           'close_at': 0}
+                           'close_at': 0,
+                           'window': metrics.Z_SCORE_WINDOW,
+                           'spread_model': 'ols'}
 
     def load_backtests(self):
         self.results_df = pd.read_csv('./data/outputs/backtester.csv', index_col=0
                                       ).sort_values(by='sharperatio', ascending=False)
 
-    def edit_settings(self, open_at=2, close_at=0):
+    def edit_settings(self, open_at=2, close_at=0, window=metrics.Z_SCORE_WINDOW, spread_model='ols'):
+        """
+        :param spread_model: one of metrics.SPREAD_MODELS, 'ols' for the researched static hedge ratios or
+        'kalman' for hedge ratios and intercepts updated on every bar
+        :type: str
+        """
+        assert spread_model in metrics.SPREAD_MODELS, \
+            f'Model "{spread_model}" must by one of {list(metrics.SPREAD_MODELS.keys())}'
+
         self.__settings['open_at'] = open_at
         self.__settings['close_at'] = close_at
-
-    def run_backtests(self) -> None:
-        rs_df = self.researched_df
-        np.vectorize(self.__run_single_backtest)(rs_df.currency1, rs_df.currency2)
+        self.__settings['window'] = window
+        self.__settings['spread_model'] = spread_model
+
+    def get_settings(self) -> dict:
+        return dict(self.__settings)
+
+    def run_backtests(self, batch: bool = True) -> None:
+        """
+        :param batch: backtest all pairs at once with the BacktestEngine, otherwise one pair at a time
+        :type: bool
+        """
+        with self.instrumentation.stage('backtest', n_in=len(self.researched_df)) as record:
+            self.results_df = pd.DataFrame()
+            if batch:
+                engine = BacktestEngine(self.hist_df, self.researched_df, initial_investment=INITIAL_INVESTMENT,
+                                        spread_model=self.__settings['spread_model'])
+                self.results_df = engine.run(self.__settings['open_at'], self.__settings['close_at'],
+                                             self.__settings['window'], cache=self.cache)
+            else:
+                for currency1, currency2 in zip(self.researched_df.currency1, self.researched_df.currency2):
+                    self.__run_single_backtest(currency1, currency2)
+            record['n_out'] = len(self.results_df)
 
     def __run_single_backtest(self, currency1, currency2) -> None:
+        start = time.perf_counter()
         pair_df = self.__set_pair_df(currency1, currency2)
         result_df = self.__get_result(pair_df, currency1, currency2)
         self.results_df = (pd.concat([self.results_df, result_df])).sort_values(by='sharperatio', ascending=False)
+        self.instrumentation.add_pair_time('backtest', time.perf_counter() - start)
 
     def __set_pair_df(self, currency1, currency2):
-        prices1 = self.hist_df[currency1].close
-        prices2 = self.hist_df[currency2].close
+        prices1 = self.hist_df[currency1].close.astype(float)
+        prices2 = self.hist_df[currency2].close.astype(float)
         ratio = self.__select_by_currencies(currency1, currency2)['ratio'].values[0]
 
+        (spreads, hedge_ratios, intercepts) = metrics.calculate_model_spread_array(
+            prices1.to_numpy().reshape(-1, 1), prices2.to_numpy().reshape(-1, 1), ratio, self.__settings['spread_model'])
+
         pair_df = pd.DataFrame()
         pair_df[currency1] = prices1
         pair_df[currency2] = prices2
-        pair_df["spread"] = metrics.calculate_spread_series(prices1, prices2, ratio)
-        pair_df["zscore"] = metrics.calculate_zscore_series(pair_df.spread)
+        pair_df["ratio"] = hedge_ratios[:, 0]
+        pair_df["intercept"] = intercepts[:, 0]
+        pair_df["spread"] = spreads[:, 0]
+        pair_df["zscore"] = metrics.calculate_zscore_series(pair_df.spread, self.__settings['window'])
         pair_df.dropna(subset='zscore', inplace=True)
 
         pair_df['signals'] = signals.set_signals(pair_df.zscore, self.__settings['open_at'],
@@ -88,6 +174,9 @@ class Backtester:
         self.results_df.to_csv('./data/outputs/backtester.csv', index=True)
 
     def plot(self, currency1, currency2):
+        # matplotlib is only imported by the plots
+        from backtest.plot import Plotter
+
         pair_df = self.__set_pair_df(currency1, currency2)
         open_at = self.__settings['open_at']
         close_at = self.__settings['close_at']
@@ -99,3 +188,34 @@ class Backtester:
         plotter.show()
 
         return pair_df
+
+    def get_pair_df(self, currency1, currency2):
+        return self.__set_pair_df(currency1, currency2)
+
+    def export_plots(self, n_pairs: int = 100, directory: str = './data/outputs/plots', max_points: int = 2400,
+                     processes: int = None) -> list:
+        """
+        Saves the plots of the n_pairs best backtested pairs as {directory}/{currency1}-{currency2}.png,
+        across a process pool without any display, and returns the saved paths.
+
+        :param max_points: number of points each line is downsampled to, 2400 is the figure width in
+        pixels, or None to plot every bar
+        :type: int
+
+        :param processes: number of processes drawing the plots, all cpus by default
+        :type: int
+        """
+        os.makedirs(directory, exist_ok=True)
+        pairs = self.results_df[['currency1', 'currency2']].drop_duplicates().head(n_pairs)
+        paths = [os.path.join(directory, f"{currency1}-{currency2}.png".replace('/', '_').replace(':', '-'))
+                 for currency1, currency2 in zip(pairs.currency1, pairs.currency2)]
+        tasks = list(zip(pairs.currency1, pairs.currency2, paths))
+
+        init_args = (self.hist_df, self.researched_df, self.get_settings(), max_points)
+        if processes == 1 or len(tasks) == 0:
+            _init_worker(*init_args)
+            return [_export_plot(*task) for task in tasks]
+
+        chunksize = max(1, len(tasks) // (4 * (processes or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=init_args) as pool:
+            return list(pool.map(_export_plot, *zip(*tasks), chunksize=chunksize))
@@ -0,0 +1,186 @@
+from backtest import metrics
+from backtest import signals
+from research import ResultCache
+import pandas as pd
+import numpy as np
+import hashlib
+
+# Max number of floats held by each (bars, pairs) array of a block of pairs
+BLOCK_SIZE = 2 ** 23
+
+STATS_COLUMNS = ['n_trades', 'sharperatio', 'max_drawdown', 'roi']
+
+RESULT_COLUMNS = ['n_trades', 'sharperatio', 'max_drawdown', 'roi', 'currency1', 'currency2', 'ratio',
+                  'correlation']
+
+
+class BacktestEngine:
+    """
+    Backtests all researched pairs at once, as (bars, pairs) arrays over blocks of pairs.
+    """
+
+    def __init__(self, hist_df: pd.DataFrame, researched_df: pd.DataFrame, initial_investment: float = 10000,
+                 block_size: int = BLOCK_SIZE, hedge_ratios: np.ndarray = None, first_bar: int = 0,
+                 spread_model: str = 'ols') -> None:
+        """
+        :param hedge_ratios: (bars, pairs) time varying hedge ratios, used instead of the researched ratios
+        :type: np.ndarray
+
+        :param first_bar: first traded bar, the previous ones only warm up the zscores
+        :type: int
+
+        :param spread_model: one of metrics.SPREAD_MODELS, 'ols' for the researched static hedge ratios or
+        'kalman' for hedge ratios and intercepts updated on every bar
+        :type: str
+        """
+        assert spread_model in metrics.SPREAD_MODELS, \
+            f'Model "{spread_model}" must by one of {list(metrics.SPREAD_MODELS.keys())}'
+
+        self.researched_df = researched_df
+        self.spread_model = spread_model
+        self.initial_investment = initial_investment
+        self.first_bar = first_bar
+        self.__hedge_ratios = hedge_ratios
+        self.index = pd.to_datetime(hist_df.index)
+
+        closes_df = hist_df.xs('close', axis=1, level=1)
+        # Closes keep the panel dtype, e.g. float32, and only each block of pairs is held in float64
+        self.__closes = closes_df.to_numpy()
+        self.__positions1 = closes_df.columns.get_indexer(researched_df['currency1'])
+        self.__positions2 = closes_df.columns.get_indexer(researched_df['currency2'])
+        self.__ratios = researched_df['ratio'].to_numpy(dtype=float)
+
+        n_pairs = len(researched_df)
+        step = max(1, block_size // max(1, len(self.index)))
+        self.blocks = [slice(start, min(start + step, n_pairs)) for start in range(0, n_pairs, step)]
+
+    def run(self, open_at: float = 2, close_at: float = 0, window: int = metrics.Z_SCORE_WINDOW,
+            cache: ResultCache = None) -> pd.DataFrame:
+        """
+        Returns the results of the pairs with more than one trade, sorted by sharpe ratio.
+
+        :param cache: cached pair stats, so only the pairs with new prices or settings are backtested
+        :type: ResultCache
+        """
+        if cache is None or self.__hedge_ratios is not None:
+            stats = [self.get_block_stats(self.get_block(pairs), open_at, close_at, window) for pairs in self.blocks]
+        else:
+            stats = [self.__get_cached_stats(cache, open_at, close_at, window)]
+        return self.get_results(stats)
+
+    def __get_cached_stats(self, cache: ResultCache, open_at: float, close_at: float, window: int) -> dict:
+        """
+        Returns the stats of all pairs, backtesting only the pairs missing from the cache.
+        """
+        keys = cache.get_keys('backtest', self.__closes, self.__positions1, self.__positions2,
+                              pair_params=self.__ratios, index=hashlib.sha256(self.index.asi8).hexdigest(),
+                              open_at=open_at, close_at=close_at, window=window, first_bar=self.first_bar,
+                              initial_investment=self.initial_investment, spread_model=self.spread_model)
+
+        def compute(missing: np.ndarray) -> tuple:
+            step = self.blocks[0].stop if self.blocks else 1
+            stats = [self.get_block_stats(self.get_block(missing[i:i + step]), open_at, close_at, window)
+                     for i in range(0, len(missing), step)]
+            return tuple(np.concatenate([block_stats[column] for block_stats in stats] or
+                                        [np.empty(0, dtype=int if column == 'n_trades' else float)])
+                         for column in STATS_COLUMNS)
+
+        columns = cache.get_or_compute('backtest', keys, list(self.researched_df['currency1']),
+                                       list(self.researched_df['currency2']), compute)
+        return {'pairs': slice(0, len(keys)), **dict(zip(STATS_COLUMNS, columns))}
+
+    def get_block(self, pairs: slice) -> dict:
+        """
+        Returns the prices, spreads and log returns of a block of pairs, as (bars, pairs) arrays.
+        """
+        prices1 = self.__closes[:, self.__positions1[pairs]].astype(float)
+        prices2 = self.__closes[:, self.__positions2[pairs]].astype(float)
+        if self.__hedge_ratios is None:
+            spreads = metrics.calculate_model_spread_array(prices1, prices2, self.__ratios[pairs], self.spread_model)[0]
+        else:
+            spreads = metrics.calculate_spread_series(prices1, prices2, self.__hedge_ratios[:, pairs])
+        return {'pairs': pairs,
+                'spreads': spreads,
+                'log_returns1': metrics.calculate_log_return_series(pd.DataFrame(prices1)).to_numpy(),
+                'log_returns2': metrics.calculate_log_return_series(pd.DataFrame(prices2)).to_numpy()}
+
+    @staticmethod
+    def get_zscores(block: dict, window: int = metrics.Z_SCORE_WINDOW) -> np.ndarray:
+        return metrics.calculate_zscore_series(pd.DataFrame(block['spreads']), window).to_numpy()
+
+    def get_block_returns(self, block: dict, open_at: float, close_at: float, window: int = metrics.Z_SCORE_WINDOW,
+                          zscores: np.ndarray = None) -> tuple:
+        """
+        Returns the signals, the dollar returns and the valid bars of each pair of the block, as
+        (bars, pairs) arrays, with NaN dollar returns out of the valid bars.
+
+        :param zscores: zscores of the block for the given window, computed when not given
+        :type: np.ndarray
+        """
+        zscores = self.get_zscores(block, window) if zscores is None else zscores
+        is_valid = ~np.isnan(zscores)
+        is_valid[:self.first_bar] = False
+        pair_signals = self.__get_signals(zscores, is_valid, open_at, close_at)
+
+        with np.errstate(invalid='ignore'):
+            log_returns_total = block['log_returns1'] * pair_signals + block['log_returns2'] * -pair_signals
+        dollar_returns = (np.exp(log_returns_total) - 1) * self.initial_investment
+        return pair_signals, np.where(is_valid, dollar_returns, np.nan), is_valid
+
+    def get_block_stats(self, block: dict, open_at: float, close_at: float, window: int = metrics.Z_SCORE_WINDOW,
+                        zscores: np.ndarray = None) -> dict:
+        """
+        Returns the number of trades, sharpe ratio, max drawdown and roi of each pair of the block.
+
+        :param zscores: zscores of the block for the given window, computed when not given
+        :type: np.ndarray
+        """
+        (pair_signals, dollar_returns, is_valid) = self.get_block_returns(block, open_at, close_at, window, zscores)
+        cum_returns = pd.DataFrame(dollar_returns).cumsum().to_numpy() + self.initial_investment
+        is_valid &= cum_returns != 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pair_metrics = metrics.calculate_metrics_array(cum_returns, self.index, pair_signals, is_valid)
+        is_traded = pair_metrics['n_trades'] > 1
+
+        stats = {'pairs': block['pairs'],
+                 'n_trades': pair_metrics['n_trades'],
+                 'sharperatio': np.where(is_traded, pair_metrics['sharperatio'], np.nan),
+                 'max_drawdown': np.where(is_traded, np.round(pair_metrics['max_drawdown_percent'] * 100, 2), np.nan),
+                 'roi': np.where(is_traded, np.round(pair_metrics['roi'] * 100, 2), np.nan)}
+
+        return stats
+
+    def get_results(self, stats: list) -> pd.DataFrame:
+        """
+        Builds the results table of the pairs with more than one trade from the stats of all blocks.
+        """
+        columns = {column: np.concatenate([block_stats[column] for block_stats in stats] or [np.empty(0)])
+                   for column in STATS_COLUMNS}
+        is_traded = columns['n_trades'] > 1
+
+        results_df = pd.DataFrame({column: values[is_traded] for column, values in columns.items()},
+                                  index=np.zeros(np.count_nonzero(is_traded), dtype=int))
+        results_df['n_trades'] = results_df['n_trades'].astype(int)
+        for column in ['currency1', 'currency2', 'ratio', 'correlation']:
+            results_df[column] = self.researched_df[column].to_numpy()[is_traded]
+
+        return results_df[RESULT_COLUMNS].sort_values(by='sharperatio', ascending=False)
+
+    @staticmethod
+    def __get_signals(zscores: np.ndarray, is_valid: np.ndarray, open_at: float, close_at: float) -> np.ndarray:
+        """
+        Signals over the valid bars of each pair only, as the per pair backtest drops the others.
+        Pairs sharing the same valid bars are computed together.
+        """
+        pair_signals = np.full(zscores.shape, np.nan)
+        if zscores.shape[1] == 0:
+            return pair_signals
+
+        masks, groups = np.unique(is_valid.T, axis=0, return_inverse=True)
+        for group, mask in enumerate(masks):
+            rows = np.nonzero(mask)[0]
+            columns = np.nonzero(groups.ravel() == group)[0]
+            pair_signals[np.ix_(rows, columns)] = signals.calculate_signals(zscores[np.ix_(rows, columns)],
+                                                                            open_at, close_at)
+        return pair_signals
@@ -14,18 +14,19 @@ def calculate_spread_series(series1: pd.Series, series2: pd.Series, hedge_ratio:
 Z_SCORE_WINDOW = 21
 
 
-def calculate_zscore_series(spread: pd.Series) -> pd.Series:
+def calculate_zscore_series(spread: pd.Series, window: int = Z_SCORE_WINDOW) -> pd.Series:
     """
-    Calculates the spread series between two series time hedge ratio on a given time series.
+    Calculates the rolling zscore of a spread series.
+    See backtest.streaming.StreamingZScore for the same zscore updated bar by bar.
     """
-    mean = spread.rolling(center=False, window=Z_SCORE_WINDOW).mean()
-    std = spread.rolling(center=False, window=Z_SCORE_WINDOW).std()
-    x = spread.rolling(center=False, window=1).mean()
-    return (x - mean) / std
+    mean = spread.rolling(center=False, window=window).mean()
+    std = spread.rolling(center=False, window=window).std()
+    return (spread - mean) / std
 
 
 def calculate_total_trades(signals: pd.Series) -> int:
-    return len(np.where(np.diff(np.sign(signals)))[0])
+    signals = np.asarray(signals, dtype=float).reshape(-1, 1)
+    return int(calculate_total_trades_array(signals, np.ones(signals.shape, dtype=bool))[0])
 
 
 def calculate_return_series(series: pd.Series) -> pd.Series:
@@ -50,7 +51,8 @@ def calculate_percent_return(series: pd.Series) -> float:
     Takes the first and last value in a series to determine the percent return,
     assuming the series is in date-ascending order
     """
-    return series.iloc[-1] / series.iloc[0] - 1
+    (values, _, is_valid) = _to_array(series)
+    return calculate_percent_return_array(values, is_valid)[0]
 
 
 def get_years_past(series: pd.Series) -> float:
@@ -58,20 +60,14 @@ def get_years_past(series: pd.Series) -> float:
     Calculate the years past according to the index of the series for use with
     functions that require annualization
     """
-    start_date = series.index[0]
-    end_date = series.index[-1]
-    return (end_date - start_date).days / 365.25
+    return get_years_past_array(series.index, np.ones((len(series), 1), dtype=bool))[0]
 
 
 def calculate_cagr(series: pd.Series) -> float:
     """
     Calculate compounded annual growth rate
     """
-    start_price = series.iloc[0]
-    end_price = series.iloc[-1]
-    value_factor = end_price / start_price
-    year_past = get_years_past(series)
-    return value_factor ** (1 / year_past) - 1
+    return calculate_cagr_array(*_to_array(series))[0]
 
 
 def calculate_annualized_volatility(return_series: pd.Series) -> float:
@@ -79,9 +75,7 @@ def calculate_annualized_volatility(return_series: pd.Series) -> float:
     Calculates annualized volatility for a date-indexed return series.
     Works for any interval of date-indexed prices and returns.
     """
-    years_past = get_years_past(return_series)
-    entries_per_year = return_series.shape[0] / years_past
-    return return_series.std() * np.sqrt(entries_per_year)
+    return calculate_annualized_volatility_array(*_to_array(return_series))[0]
 
 
 def calculate_sharpe_ratio(price_series: pd.Series,
@@ -90,10 +84,7 @@ def calculate_sharpe_ratio(price_series: pd.Series,
     Calculates the Sharpe ratio given a price series. Defaults to benchmark_rate
     of zero.
     """
-    cagr = calculate_cagr(price_series)
-    return_series = calculate_return_series(price_series)
-    volatility = calculate_annualized_volatility(return_series)
-    return (cagr - benchmark_rate) / volatility
+    return calculate_sharpe_ratio_array(*_to_array(price_series), benchmark_rate=benchmark_rate)[0]
 
 
 DRAWDOWN_EVALUATORS: Dict[str, Callable] = {
@@ -118,6 +109,236 @@ def calculate_max_drawdown(series: pd.Series, method: str = 'percent') -> float:
     """
     Simply returns the max drawdown as a float
     """
-    return calculate_drawdown_series(series, method).max()
+    (values, _, is_valid) = _to_array(series)
+    return calculate_max_drawdown_array(values, is_valid, method=method)[0]
+
+
+# Batched metrics over the equity curves of many pairs, as (bars, pairs) arrays sharing a time index.
+# The bars of a pair are those of its is_valid mask, which is ~isnan(values) by default, and each
+# pair gets the same result as the single series functions over its own bars.
+
+
+def _to_array(series: pd.Series) -> tuple:
+    values = np.asarray(series, dtype=float).reshape(-1, 1)
+    return values, series.index, np.ones(values.shape, dtype=bool)
+
+
+def _get_valid(values: np.ndarray, is_valid: np.ndarray = None) -> np.ndarray:
+    return ~np.isnan(values) if is_valid is None else is_valid
+
+
+def _get_bounds(is_valid: np.ndarray) -> tuple:
+    """
+    Returns the first and last valid bar of each pair, and whether it has any.
+    """
+    first = is_valid.argmax(axis=0)
+    last = len(is_valid) - 1 - is_valid[::-1].argmax(axis=0)
+    return first, last, is_valid.any(axis=0)
+
+
+def _get_previous(values: np.ndarray, is_valid: np.ndarray) -> tuple:
+    """
+    Returns the value of the previous valid bar of each valid bar, or NaN, and whether it has one.
+    """
+    rows = np.arange(len(values)).reshape(-1, 1)
+    last_rows = np.maximum.accumulate(np.where(is_valid, rows, -1), axis=0)
+    previous_rows = np.vstack([np.full((1, values.shape[1]), -1), last_rows[:-1]])
+    has_previous = is_valid & (previous_rows >= 0)
+    previous = np.take_along_axis(values, np.maximum(previous_rows, 0), axis=0)
+    return np.where(has_previous, previous, np.nan), has_previous
+
+
+def get_years_past_array(index: pd.Index, is_valid: np.ndarray) -> np.ndarray:
+    first, last, has_values = _get_bounds(is_valid)
+    index = pd.DatetimeIndex(index)
+    days = np.asarray((index[last] - index[first]).days, dtype=float)
+    return np.where(has_values, days / 365.25, np.nan)
+
+
+def calculate_return_array(values: np.ndarray, is_valid: np.ndarray = None) -> np.ndarray:
+    is_valid = _get_valid(values, is_valid)
+    return np.where(is_valid, values / _get_previous(values, is_valid)[0] - 1, np.nan)
+
+
+def calculate_percent_return_array(values: np.ndarray, is_valid: np.ndarray = None) -> np.ndarray:
+    first, last, has_values = _get_bounds(_get_valid(values, is_valid))
+    pairs = np.arange(values.shape[1])
+    return np.where(has_values, values[last, pairs] / values[first, pairs] - 1, np.nan)
+
+
+def calculate_cagr_array(values: np.ndarray, index: pd.Index, is_valid: np.ndarray = None) -> np.ndarray:
+    is_valid = _get_valid(values, is_valid)
+    value_factor = calculate_percent_return_array(values, is_valid) + 1
+    return value_factor ** (1 / get_years_past_array(index, is_valid)) - 1
+
+
+def calculate_annualized_volatility_array(return_values: np.ndarray, index: pd.Index,
+                                          is_valid: np.ndarray = None) -> np.ndarray:
+    """
+    Annualized volatility of each pair, as the sample std of its non NaN returns times the square
+    root of its valid bars per year.
+    """
+    is_valid = _get_valid(return_values, is_valid)
+    is_counted = is_valid & ~np.isnan(return_values)
+    n_returns = is_counted.sum(axis=0)
+    mean = np.where(is_counted, return_values, 0.0).sum(axis=0) / n_returns
+    squares = np.where(is_counted, (mean - return_values) ** 2, 0.0).sum(axis=0)
+    std = np.where(n_returns > 1, squares / np.maximum(n_returns - 1, 1), np.nan) ** 0.5
+
+    entries_per_year = is_valid.sum(axis=0) / get_years_past_array(index, is_valid)
+    return std * np.sqrt(entries_per_year)
+
+
+def calculate_sharpe_ratio_array(values: np.ndarray, index: pd.Index, is_valid: np.ndarray = None,
+                                 benchmark_rate: float = 0) -> np.ndarray:
+    is_valid = _get_valid(values, is_valid)
+    cagr = calculate_cagr_array(values, index, is_valid)
+    volatility = calculate_annualized_volatility_array(calculate_return_array(values, is_valid), index, is_valid)
+    return (cagr - benchmark_rate) / volatility
+
+
+def calculate_drawdown_array(values: np.ndarray, is_valid: np.ndarray = None, method: str = 'percent') -> np.ndarray:
+    assert method in DRAWDOWN_EVALUATORS, \
+        f'Method "{method}" must by one of {list(DRAWDOWN_EVALUATORS.keys())}'
+
+    values = np.where(_get_valid(values, is_valid), values, np.nan)
+    return DRAWDOWN_EVALUATORS[method](values, np.fmax.accumulate(values, axis=0))
+
+
+def calculate_max_drawdown_array(values: np.ndarray, is_valid: np.ndarray = None,
+                                 method: str = 'percent') -> np.ndarray:
+    return np.fmax.reduce(calculate_drawdown_array(values, is_valid, method), axis=0)
+
+
+def calculate_total_trades_array(signals: np.ndarray, is_valid: np.ndarray = None) -> np.ndarray:
+    """
+    Number of signal sign changes between the consecutive valid bars of each pair, where changes from
+    or to a NaN signal count as well.
+    """
+    is_valid = _get_valid(signals, is_valid)
+    signs = np.sign(signals)
+    (previous_signs, has_previous) = _get_previous(signs, is_valid)
+    return np.count_nonzero(has_previous & (signs - previous_signs != 0), axis=0)
+
+
+def calculate_metrics_array(values: np.ndarray, index: pd.Index, signals: np.ndarray = None,
+                            is_valid: np.ndarray = None, benchmark_rate: float = 0) -> dict:
+    """
+    Returns every metric of each pair equity curve in one pass, with the number of trades when the
+    signals are given.
+    """
+    is_valid = _get_valid(values, is_valid)
+    years_past = get_years_past_array(index, is_valid)
+    roi = calculate_percent_return_array(values, is_valid)
+    cagr = (roi + 1) ** (1 / years_past) - 1
+
+    return_values = calculate_return_array(values, is_valid)
+    volatility = calculate_annualized_volatility_array(return_values, index, is_valid)
+
+    values = np.where(is_valid, values, np.nan)
+    peaks = np.fmax.accumulate(values, axis=0)
+    results = {'sharperatio': (cagr - benchmark_rate) / volatility,
+               'cagr': cagr,
+               'volatility': volatility,
+               'roi': roi}
+    for method, evaluator in DRAWDOWN_EVALUATORS.items():
+        results[f'max_drawdown_{method}'] = np.fmax.reduce(evaluator(values, peaks), axis=0)
+    if signals is not None:
+        results['n_trades'] = calculate_total_trades_array(signals, is_valid)
+
+    return results
+
+
+# Spread models of the pairs, as (bars, pairs) arrays: 'ols' keeps the static researched hedge ratio of
+# each pair, and 'kalman' estimates a hedge ratio and an intercept following a random walk, updated on
+# every bar by a Kalman filter running over all pairs at once. The filter runs on the prices of each pair
+# divided by its first valid prices, so its variances are relative to the prices and fit every pair.
+
+# Variance of the random walk of the hedge ratio and intercept, as delta / (1 - delta)
+KALMAN_DELTA = 1e-4
+
+# Variance of the prices of currency1 around the hedged prices of currency2, relative to their first prices
+KALMAN_OBSERVATION_VARIANCE = 1e-3
+
+
+def get_kalman_state(n_pairs: int) -> dict:
+    """
+    Returns the state of the Kalman filters of n_pairs pairs, without any estimate until the first
+    valid prices of each pair.
+    """
+    return {'ratio': np.full(n_pairs, np.nan),
+            'intercept': np.full(n_pairs, np.nan),
+            'covariance': np.zeros((n_pairs, 2, 2)),
+            'scale1': np.full(n_pairs, np.nan),
+            'scale2': np.full(n_pairs, np.nan)}
+
+
+def update_kalman_state(state: dict, prices1: np.ndarray, prices2: np.ndarray, delta: float = KALMAN_DELTA,
+                        observation_variance: float = KALMAN_OBSERVATION_VARIANCE) -> tuple:
+    """
+    Updates the state with the prices of a new bar, of shape (pairs,), and returns the hedge ratios and
+    intercepts estimated up to the previous bar, so the spread of a bar does not use its own prices.
+    The first valid prices of a pair scale its next prices and start its hedge ratio at prices1 / prices2,
+    and NaN prices leave the state as it is.
+    """
+    (ratio, intercept, covariance) = (state['ratio'], state['intercept'], state['covariance'])
+    is_valid = ~(np.isnan(prices1) | np.isnan(prices2))
+    is_started = ~np.isnan(ratio)
+    is_updated = is_valid & is_started
+    is_first = is_valid & ~is_started
+    scale1 = np.where(is_first, prices1, state['scale1'])
+    scale2 = np.where(is_first, prices2, state['scale2'])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        (x, y) = (np.where(is_updated, prices2 / scale2, 0.0), np.where(is_updated, prices1 / scale1, 0.0))
 
+    # Predicted covariance, then the gain of the observation y = ratio * x + intercept
+    predicted = covariance + delta / (1 - delta) * np.eye(2)
+    predicted_h = predicted[:, :, 0] * x[:, None] + predicted[:, :, 1]
+    variance = predicted_h[:, 0] * x + predicted_h[:, 1] + observation_variance
+    gain = predicted_h / variance[:, None]
+    error = y - (np.nan_to_num(ratio) * x + np.nan_to_num(intercept))
+
+    state['ratio'] = np.where(is_updated, ratio + gain[:, 0] * error, np.where(is_first, 1.0, ratio))
+    state['intercept'] = np.where(is_updated, intercept + gain[:, 1] * error, np.where(is_first, 0.0, intercept))
+    state['covariance'] = np.where(is_updated[:, None, None], predicted - gain[:, :, None] * predicted_h[:, None, :],
+                                   covariance)
+    (state['scale1'], state['scale2']) = (scale1, scale2)
+
+    # Back to the prices: prices1 = ratio * scale1 / scale2 * prices2 + intercept * scale1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(is_valid, ratio * scale1 / scale2, np.nan), np.where(is_valid, intercept * scale1, np.nan)
+
+
+def calculate_kalman_hedge_ratio_array(prices1: np.ndarray, prices2: np.ndarray, delta: float = KALMAN_DELTA,
+                                       observation_variance: float = KALMAN_OBSERVATION_VARIANCE) -> tuple:
+    """
+    Returns the (bars, pairs) Kalman hedge ratios and intercepts of each bar, estimated up to the
+    previous bar, as update_kalman_state over every bar.
+    """
+    state = get_kalman_state(prices1.shape[1])
+    ratios = np.empty(prices1.shape)
+    intercepts = np.empty(prices1.shape)
+    for bar in range(len(prices1)):
+        ratios[bar], intercepts[bar] = update_kalman_state(state, prices1[bar], prices2[bar], delta,
+                                                           observation_variance)
+    return ratios, intercepts
+
+
+SPREAD_MODELS: Dict[str, Callable] = {
+    'ols': lambda prices1, prices2, ratios: (np.broadcast_to(ratios, prices1.shape), np.broadcast_to(0.0, prices1.shape)),
+    'kalman': lambda prices1, prices2, ratios: calculate_kalman_hedge_ratio_array(prices1, prices2),
+}
+
+
+def calculate_model_spread_array(prices1: np.ndarray, prices2: np.ndarray, ratios: np.ndarray,
+                                 model: str = 'ols') -> tuple:
+    """
+    Returns the (bars, pairs) spreads, hedge ratios and intercepts of a spread model.
+
+    :param ratios: static researched hedge ratio of each pair, used by the 'ols' model
+    :type: np.ndarray
+    """
+    assert model in SPREAD_MODELS, f'Model "{model}" must by one of {list(SPREAD_MODELS.keys())}'
 
+    (hedge_ratios, intercepts) = SPREAD_MODELS[model](prices1, prices2, ratios)
+    return prices1 - prices2 * hedge_ratios - intercepts, hedge_ratios, intercepts
@@ -1,20 +1,70 @@
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import matplotlib.ticker as ticker
-import statsmodels.api as sm
+from matplotlib.figure import Figure
 import pandas as pd
+import numpy as np
+
+
+def get_lttb_positions(x: np.ndarray, y: np.ndarray, n_points: int) -> np.ndarray:
+    """
+    Largest triangle three buckets downsampling: returns the positions of n_points of the (x, y)
+    line, keeping the first and last points and, from each bucket in between, the point making the
+    largest triangle with the previous kept point and the average of the next bucket, which keeps
+    the peaks and troughs of the line.
+    """
+    n_values = len(x)
+    if n_points >= n_values or n_points < 3:
+        return np.arange(n_values)
+
+    edges = np.linspace(1, n_values - 1, n_points - 1).astype(int)
+    averages_x = np.append(np.add.reduceat(x[1:-1], edges[:-1] - 1) / np.diff(edges), x[-1])
+    averages_y = np.append(np.add.reduceat(y[1:-1], edges[:-1] - 1) / np.diff(edges), y[-1])
+
+    positions = np.empty(n_points, dtype=int)
+    positions[0] = 0
+    positions[-1] = n_values - 1
+    for bucket in range(n_points - 2):
+        (start, end, last) = (edges[bucket], edges[bucket + 1], positions[bucket])
+        (next_x, next_y) = (averages_x[bucket + 1], averages_y[bucket + 1])
+        areas = np.abs((x[last] - next_x) * (y[start:end] - y[last]) - (x[last] - x[start:end]) * (next_y - y[last]))
+        positions[bucket + 1] = start + areas.argmax()
+    return positions
 
 
 class Plotter:
-    def __init__(self, pair_df, open_at=2, close_at=0, n_plots=5):
+    def __init__(self, pair_df, open_at=2, close_at=0, n_plots=5, max_points=None, headless=False):
+        """
+        :param max_points: number of points each line is downsampled to, e.g. the figure width in
+        pixels, or None to plot every bar
+        :type: int
+
+        :param headless: draw on a figure without pyplot, that can only be saved, e.g. in processes
+        without a display
+        :type: bool
+        """
         self.pair_df = pair_df
         self.ax_counter = 0
         self.open_at = open_at
         self.close_at = close_at
+        self.max_points = max_points
         self.initial_investment = 10000
         self.currency1 = ''
         self.currency2 = ''
-        self.fig, self.ax = plt.subplots(nrows=n_plots, figsize=(30, 6*n_plots), dpi=80)
+        if headless:
+            self.fig = Figure(figsize=(30, 6*n_plots), dpi=80)
+            self.ax = self.fig.subplots(nrows=n_plots)
+        else:
+            self.fig, self.ax = plt.subplots(nrows=n_plots, figsize=(30, 6*n_plots), dpi=80)
+
+    def set_pair_df(self, pair_df):
+        """
+        Clears the plots to draw another pair on the same figure.
+        """
+        self.pair_df = pair_df
+        self.ax_counter = 0
+        for ax in self.ax:
+            ax.clear()
 
     def set_currencies(self, currency1, currency2):
         self.currency1 = currency1
@@ -59,34 +109,24 @@ class Plotter:
             series1 = self.pair_df[self.currency1]
             series2 = self.pair_df[self.currency2]
 
-            ratio = sm.OLS(series1, series2).fit().params[0]
+            # Hedge ratios of the spread model of the backtest, or a no intercept OLS of the prices
+            if 'ratio' in self.pair_df:
+                hedged = series2 * self.pair_df['ratio'] + self.pair_df['intercept']
+            else:
+                hedged = series2 * (series1 @ series2) / (series2 @ series2)
             dates = series1.index = pd.to_datetime(series1.index)
 
-            ax.plot(dates, series1)
-            ax.plot(dates, series2*ratio)
+            ax.plot(*self.__downsample(dates, series1))
+            ax.plot(*self.__downsample(dates, hedged))
             ax.legend([f'{self.currency1}', f'{self.currency2}*ratio'], loc="upper left")
 
         else:
             series = self.pair_df[metric]
             dates = series.index = pd.to_datetime(series.index)
-            ax.plot(dates, series)
+            ax.plot(*self.__downsample(dates, series))
             ax.legend([metric], loc="upper left")
 
-        tick_positions = []
-        tick_labels = []
-
-        for date in dates:
-            if date.month == 1 and date.day == 1:
-                tick_positions.append(date)
-                tick_labels.append(date.strftime('%Y'))
-
-            elif date.day in [10, 20]:
-                tick_positions.append(date)
-                tick_labels.append(date.strftime('%d'))
-
-            elif date.day == 1:
-                tick_positions.append(date)
-                tick_labels.append(date.strftime('%b'))
+        (tick_positions, tick_labels) = self.__get_ticks(dates)
 
         ax.set_xticks(tick_positions)
         ax.set_xticklabels(tick_labels)
@@ -106,7 +146,38 @@ class Plotter:
             ax.set_yticks([-open_at, close_at, open_at], minor=False)
             ax.yaxis.grid(True, which='major', color='orange')
 
-
+    def __downsample(self, dates, series):
+        if self.max_points is None:
+            return dates, series
+
+        is_valid = series.notna().to_numpy()
+        (dates, values) = (dates[is_valid], series.to_numpy(dtype=float)[is_valid])
+        positions = get_lttb_positions(dates.asi8.astype(float), values, self.max_points)
+        return dates[positions], values[positions]
+
+    @staticmethod
+    def __get_ticks(dates):
+        """
+        Ticks the first bar of the days 1, 10 and 20 of each month, labeled by year on January 1st, by
+        month on the other 1st days, and by day otherwise.
+        """
+        is_first_bar = ~dates.normalize().duplicated()
+        is_year = is_first_bar & (dates.month == 1) & (dates.day == 1)
+        is_day = is_first_bar & np.isin(dates.day, [10, 20])
+        is_month = is_first_bar & (dates.day == 1) & ~is_year
+
+        is_tick = is_year | is_day | is_month
+        tick_positions = dates[is_tick]
+        tick_labels = np.where(is_year[is_tick], tick_positions.strftime('%Y'),
+                               np.where(is_day[is_tick], tick_positions.strftime('%d'), tick_positions.strftime('%b')))
+        return tick_positions, list(tick_labels)
+
+    def save(self, path):
+        """
+        Saves the figure, PNG files with a fast compression level.
+        """
+        self.fig.tight_layout()
+        self.fig.savefig(path, pil_kwargs={'compress_level': 1} if str(path).endswith('.png') else None)
 
     def show(self):
         plt.tight_layout()
@@ -3,18 +3,59 @@ import pandas as pd
 
 
 def set_signals(series: pd.Series,  open_at: float = 2.0, close_at: float = 0.0) -> pd.Series:
+    """
+    Single pair wrapper of calculate_signals, keeping the series index.
+    """
+    signals = calculate_signals(series.to_numpy(dtype=float), open_at, close_at)
+    return pd.Series(signals, index=series.index, name=series.name)
 
-    # Set signals by Trading Conditions
-    signals = series.copy()
 
-    for i in range(0, len(series)):
-        buy_entry_signal = series.iloc[i] <= -abs(open_at)
-        buy_close_signal = (signals.iloc[i-1] == 1) & (series.iloc[i] <= abs(close_at))
+def calculate_signals(zscores: np.ndarray, open_at: float = 2.0, close_at: float = 0.0) -> np.ndarray:
+    """
+    Calculates the trading signals of a zscore array of shape (bars,) or (bars, pairs).
 
-        sell_entry_signal = series[i] >= abs(open_at)
-        sell_close_signal = (signals.iloc[i-1] == -1) & (series.iloc[i] >= -abs(close_at))
+    A position is opened when the zscore reaches -open_at (long) or +open_at (short), and it is held
+    while the zscore stays below +close_at (long) or above -close_at (short). Signals are shifted by
+    one bar, so they can be applied to the returns of the next bar.
+    """
+    zscores = np.asarray(zscores, dtype=float)
+    is_vector = zscores.ndim == 1
+    z = zscores.reshape(len(zscores), -1)
+    n_bars = z.shape[0]
 
-        signals.iloc[i] = 1 if buy_entry_signal or buy_close_signal else -1 if sell_entry_signal or sell_close_signal else 0
+    if n_bars == 0:
+        return np.zeros(zscores.shape)
 
-    return signals.shift().fillna(0)
-    return signals
+    with np.errstate(invalid='ignore'):
+        buy_entry = z <= -abs(open_at)
+        sell_entry = (z >= abs(open_at)) & ~buy_entry
+        buy_hold = z <= abs(close_at)
+        sell_hold = z >= -abs(close_at)
+
+    # Row 0 is a virtual bar with the state seen before the first zscore, which is the last zscore
+    # itself, as the original loop read signals.iloc[-1] before overwriting it.
+    initial = np.where(np.isin(z[-1], (1.0, -1.0)), z[-1], 0.0).reshape(1, -1)
+    rows = np.arange(n_bars + 1).reshape(-1, 1)
+
+    def last_row(mask: np.ndarray) -> np.ndarray:
+        return np.maximum.accumulate(np.where(mask, rows, -1), axis=0)
+
+    def is_held(events: np.ndarray, breaks: np.ndarray) -> np.ndarray:
+        last_event = last_row(events)
+        return (last_event >= 0) & (last_row(breaks) <= last_event)
+
+    # A long is held from its last entry while the zscore stays below close_at, and it has priority
+    # over any short entry, so shorts are only opened and held outside of longs.
+    no_break = np.zeros_like(initial, dtype=bool)
+    is_long = is_held(np.vstack([initial == 1, buy_entry]),
+                      np.vstack([no_break, ~buy_hold]))
+    is_short = ~is_long & is_held(np.vstack([initial == -1, sell_entry]) & ~is_long,
+                                  np.vstack([no_break, ~sell_hold | buy_entry]))
+
+    signals = np.where(is_long, 1.0, np.where(is_short, -1.0, 0.0))
+
+    # Dropping the last bar of the state shifts the signals one bar forward
+    signals = signals[:-1]
+    signals[0] = 0.0
+
+    return signals.reshape(zscores.shape) if is_vector else signals
@@ -0,0 +1,180 @@
+from backtest.engine import BacktestEngine
+from backtest.backtester import INITIAL_INVESTMENT
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import os
+
+# Max number of floats held by each (bars, resamples) array of a pair, small enough to stay in the cpu caches
+BLOCK_SIZE = 2 ** 17
+
+# Tested metrics, and whether higher values are better
+TESTED_METRICS = {'sharperatio': True, 'roi': True, 'max_drawdown': False}
+
+_shared = {}
+
+
+def _init_worker(hist_df: pd.DataFrame, results_df: pd.DataFrame, settings: dict, block_size: int) -> None:
+    engine = BacktestEngine(hist_df, results_df, initial_investment=INITIAL_INVESTMENT, block_size=block_size,
+                            spread_model=settings['spread_model'])
+    _shared.update({'engine': engine, 'settings': settings})
+
+
+def _test_block(block_number: int, seeds: list) -> list:
+    """
+    Tests every pair of a block of the engine, each with its own random generator.
+    """
+    (engine, settings) = (_shared['engine'], _shared['settings'])
+    block = engine.get_block(engine.blocks[block_number])
+    (pair_signals, dollar_returns, is_valid) = engine.get_block_returns(block, settings['open_at'],
+                                                                        settings['close_at'], settings['window'])
+    spread_returns = block['log_returns1'] - block['log_returns2']
+
+    results = []
+    for pair, seed in enumerate(seeds):
+        rows = np.flatnonzero(is_valid[:, pair])
+        with np.errstate(invalid='ignore'):
+            results.append(_test_pair(np.nan_to_num(dollar_returns[rows, pair]), np.nan_to_num(pair_signals[rows, pair]),
+                                      np.nan_to_num(spread_returns[rows, pair]), engine.index[rows],
+                                      np.random.default_rng(seed), settings))
+    return results
+
+
+def _test_pair(dollar_returns: np.ndarray, pair_signals: np.ndarray, spread_returns: np.ndarray,
+               index: pd.DatetimeIndex, rng: np.random.Generator, settings: dict) -> dict:
+    """
+    Returns the metrics of a pair, their block bootstrap confidence intervals, and their p-values
+    against random entry strategies with the same trades.
+    """
+    (n_bars, n_resamples) = (len(dollar_returns), settings['n_resamples'])
+    observed = _get_metrics(dollar_returns.reshape(-1, 1), index)
+    result = {'n_bars': n_bars}
+    if n_bars < 2:
+        return {**result, **{f'{name}{suffix}': np.nan for name in TESTED_METRICS
+                             for suffix in ['', '_low', '_high', '_p_value']}}
+
+    # Moving block bootstrap of the dollar returns, keeping their autocorrelation within each block
+    block_bars = min(n_bars, settings['block_bars'] or max(1, int(round(n_bars ** (1 / 3)))))
+    n_blocks = -(-n_bars // block_bars)
+    offsets = np.arange(block_bars).reshape(1, -1, 1)
+
+    # Random entries: the signals shifted circularly by a random offset, so the trades keep their
+    # number, directions and durations, but not their timing
+    shifts = np.arange(n_bars).reshape(-1, 1)
+
+    (bootstrap, null) = ([], [])
+    step = max(1, BLOCK_SIZE // n_bars)
+    for start in range(0, n_resamples, step):
+        n = min(step, n_resamples - start)
+        starts = rng.integers(0, n_bars - block_bars + 1, size=(n_blocks, 1, n))
+        rows = (starts + offsets).reshape(-1, n)[:n_bars]
+        bootstrap.append(_get_metrics(dollar_returns[rows], index))
+
+        shifted_signals = pair_signals[(shifts + rng.integers(1, n_bars, size=n)) % n_bars]
+        null_returns = (np.exp(shifted_signals * spread_returns.reshape(-1, 1)) - 1) * INITIAL_INVESTMENT
+        null.append(_get_metrics(null_returns, index))
+
+    alpha = settings['alpha']
+    for name, is_higher_better in TESTED_METRICS.items():
+        resampled = np.concatenate([values[name] for values in bootstrap])
+        null_values = np.concatenate([values[name] for values in null])
+        value = observed[name][0]
+        is_as_good = null_values >= value if is_higher_better else null_values <= value
+
+        result[name] = value
+        (result[f'{name}_low'], result[f'{name}_high']) = np.nanpercentile(resampled, [50 * alpha, 100 - 50 * alpha])
+        result[f'{name}_p_value'] = (1 + np.count_nonzero(is_as_good)) / (1 + n_resamples) if not np.isnan(value) \
+            else np.nan
+    return result
+
+
+def _get_metrics(dollar_returns: np.ndarray, index: pd.DatetimeIndex) -> dict:
+    """
+    Sharpe ratio, roi and max drawdown, both in percent, of the (bars, resamples) dollar returns, as
+    metrics.calculate_metrics_array over the backtest equity curves, without its masks since every bar
+    of the resamples is valid.
+    """
+    cum_returns = np.cumsum(dollar_returns, axis=0) + INITIAL_INVESTMENT
+    years_past = (index[-1] - index[0]).days / 365.25
+    with np.errstate(divide='ignore', invalid='ignore'):
+        roi = cum_returns[-1] / cum_returns[0] - 1
+        cagr = (roi + 1) ** (1 / years_past) - 1
+        returns = cum_returns[1:] / cum_returns[:-1] - 1
+        volatility = returns.std(axis=0, ddof=1) * np.sqrt(len(cum_returns) / years_past)
+        drawdown = np.max(1 - cum_returns / np.maximum.accumulate(cum_returns, axis=0), axis=0)
+    return {'sharperatio': cagr / volatility, 'roi': roi * 100, 'max_drawdown': drawdown * 100}
+
+
+class Significance:
+    """
+    Significance of the backtested pairs: block bootstrap confidence intervals of their sharpe ratio,
+    roi and max drawdown, and p-values against random entry strategies with the same trades, so the
+    pairs that were only lucky in sample stand out.
+    """
+
+    def __init__(self, backtester, n_resamples: int = 1000, block_bars: int = None, alpha: float = 0.05,
+                 processes: int = None, seed: int = 0) -> None:
+        """
+        :param backtester: Backtester whose results are tested, after run_backtests
+        :type: Backtester
+
+        :param n_resamples: number of bootstrap resamples and of random entry strategies of each pair
+        :type: int
+
+        :param block_bars: number of bars of the bootstrap blocks, the cube root of the bars of each pair
+        by default
+        :type: int
+
+        :param alpha: the confidence intervals hold 1 - alpha of the resamples
+        :type: float
+
+        :param processes: number of processes testing the pairs, all cpus by default
+        :type: int
+
+        :param seed: seed of the resamples, each pair getting its own stream, so the results do not depend
+        on the processes
+        :type: int
+        """
+        self.backtester = backtester
+        self.seed = seed
+        self.significance_df = pd.DataFrame()
+        self.__processes = processes
+        self.__settings = {**backtester.get_settings(), 'n_resamples': n_resamples, 'block_bars': block_bars,
+                           'alpha': alpha}
+
+    def run(self) -> pd.DataFrame:
+        """
+        Returns the metrics, confidence intervals and p-values of every backtested pair, in the order
+        of the backtest results.
+        """
+        results_df = self.backtester.results_df.reset_index(drop=True)
+        with self.backtester.instrumentation.stage('significance', n_in=len(results_df)) as record:
+            # Blocks of pairs small enough to spread them over the processes, as the engine blocks
+            n_pairs = len(results_df)
+            step = max(1, -(-n_pairs // (4 * (self.__processes or os.cpu_count() or 1))))
+            init_args = (self.backtester.hist_df, results_df, self.__settings, step * len(self.backtester.hist_df))
+
+            seeds = np.random.SeedSequence(self.seed).spawn(n_pairs)
+            tasks = [(number, seeds[start:start + step]) for number, start in enumerate(range(0, n_pairs, step))]
+
+            if len(tasks) == 0:
+                outputs = []
+            elif self.__processes == 1 or len(tasks) == 1:
+                _init_worker(*init_args)
+                outputs = [_test_block(*task) for task in tasks]
+            else:
+                with ProcessPoolExecutor(max_workers=self.__processes, initializer=_init_worker,
+                                         initargs=init_args) as pool:
+                    outputs = list(pool.map(_test_block, *zip(*tasks)))
+
+            significance_df = pd.DataFrame([result for block_results in outputs for result in block_results])
+            if len(significance_df) > 0:
+                for position, column in enumerate(['currency1', 'currency2', 'n_trades']):
+                    significance_df.insert(position, column, results_df[column])
+            self.significance_df = significance_df
+            record['n_out'] = len(significance_df)
+        return self.significance_df
+
+    def save_outputs(self) -> None:
+        os.makedirs('./data/outputs', exist_ok=True)
+        self.significance_df.to_csv('./data/outputs/significance.csv', index=True)
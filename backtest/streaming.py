@@ -0,0 +1,185 @@
+from backtest import metrics
+import numpy as np
+
+
+class StreamingZScore:
+    """
+    Rolling zscore of the spreads of many pairs, updated in constant time per bar.
+
+    The last window spreads are kept in a ring buffer, and the running mean and variance follow the
+    same compensated online updates as the pandas rolling mean and std, so each update equals the last
+    value of calculate_zscore_series over the same spreads.
+    """
+
+    def __init__(self, n_pairs: int, window: int = metrics.Z_SCORE_WINDOW) -> None:
+        self.window = window
+        self.n_bars = 0
+        self.__buffer = np.full((window, n_pairs), np.nan)
+
+        self.__nobs = np.zeros(n_pairs)
+        self.__same_values = np.zeros(n_pairs)
+        self.__prev_value = np.full(n_pairs, np.nan)
+
+        # Kahan sum of the rolling mean
+        self.__sum = np.zeros(n_pairs)
+        self.__sum_add_compensation = np.zeros(n_pairs)
+        self.__sum_remove_compensation = np.zeros(n_pairs)
+        self.__negatives = np.zeros(n_pairs)
+
+        # Welford mean and squared deviations of the rolling variance
+        self.__mean = np.zeros(n_pairs)
+        self.__ssqdm = np.zeros(n_pairs)
+        self.__var_add_compensation = np.zeros(n_pairs)
+        self.__var_remove_compensation = np.zeros(n_pairs)
+
+    def update(self, spreads: np.ndarray) -> np.ndarray:
+        """
+        Adds the spreads of a new bar, of shape (pairs,), and returns their zscores.
+        """
+        spreads = np.asarray(spreads, dtype=float)
+        position = self.n_bars % self.window
+
+        if self.n_bars >= self.window:
+            self.__remove(self.__buffer[position])
+        self.__add(spreads)
+
+        self.__buffer[position] = spreads
+        self.n_bars += 1
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (spreads - self.__get_mean()) / np.sqrt(self.__get_var())
+
+    def __add(self, values: np.ndarray) -> None:
+        is_valid = ~np.isnan(values)
+        values = np.where(is_valid, values, 0.0)
+        nobs = self.__nobs + is_valid
+
+        self.__same_values = np.where(is_valid, np.where(values == self.__prev_value, self.__same_values + 1, 1),
+                                      self.__same_values)
+        self.__prev_value = np.where(is_valid, values, self.__prev_value)
+
+        y = values - self.__sum_add_compensation
+        t = self.__sum + y
+        self.__sum_add_compensation = np.where(is_valid, t - self.__sum - y, self.__sum_add_compensation)
+        self.__sum = np.where(is_valid, t, self.__sum)
+        self.__negatives += is_valid & np.signbit(values)
+
+        prev_mean = self.__mean - self.__var_add_compensation
+        y = values - self.__var_add_compensation
+        t = y - self.__mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(nobs > 0, self.__mean + t / nobs, 0.0)
+        self.__var_add_compensation = np.where(is_valid, t + self.__mean - y, self.__var_add_compensation)
+        self.__ssqdm = np.where(is_valid, self.__ssqdm + (values - prev_mean) * (values - mean), self.__ssqdm)
+        self.__mean = np.where(is_valid, mean, self.__mean)
+
+        self.__nobs = nobs
+
+    def __remove(self, values: np.ndarray) -> None:
+        is_valid = ~np.isnan(values)
+        values = np.where(is_valid, values, 0.0)
+        nobs = self.__nobs - is_valid
+
+        y = -values - self.__sum_remove_compensation
+        t = self.__sum + y
+        self.__sum_remove_compensation = np.where(is_valid, t - self.__sum - y, self.__sum_remove_compensation)
+        self.__sum = np.where(is_valid, t, self.__sum)
+        self.__negatives -= is_valid & np.signbit(values)
+
+        prev_mean = self.__mean - self.__var_remove_compensation
+        y = values - self.__var_remove_compensation
+        t = y - self.__mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(nobs > 0, self.__mean - t / nobs, 0.0)
+        is_updated = is_valid & (nobs > 0)
+        self.__var_remove_compensation = np.where(is_updated, t + self.__mean - y, self.__var_remove_compensation)
+        self.__ssqdm = np.where(is_updated, self.__ssqdm - (values - prev_mean) * (values - mean),
+                                np.where(is_valid, 0.0, self.__ssqdm))
+        self.__mean = np.where(is_valid, mean, self.__mean)
+
+        self.__nobs = nobs
+
+    def __get_mean(self) -> np.ndarray:
+        nobs = self.__nobs
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.__sum / nobs
+        mean = np.where(self.__same_values >= nobs, self.__prev_value,
+                        np.where((self.__negatives == 0) & (mean < 0), 0.0,
+                                 np.where((self.__negatives == nobs) & (mean > 0), 0.0, mean)))
+        return np.where(nobs >= self.window, mean, np.nan)
+
+    def __get_var(self) -> np.ndarray:
+        nobs = self.__nobs
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = np.maximum(self.__ssqdm / (nobs - 1), 0.0)
+        var = np.where((nobs == 1) | (self.__same_values >= nobs), 0.0, var)
+        return np.where((nobs >= self.window) & (nobs > 1), var, np.nan)
+
+
+class StreamingKalman:
+    """
+    Kalman hedge ratios and intercepts of many pairs, updated in constant time per bar, as the live
+    counterpart of metrics.calculate_kalman_hedge_ratio_array.
+    """
+
+    def __init__(self, n_pairs: int, delta: float = metrics.KALMAN_DELTA,
+                 observation_variance: float = metrics.KALMAN_OBSERVATION_VARIANCE) -> None:
+        self.delta = delta
+        self.observation_variance = observation_variance
+        self.state = metrics.get_kalman_state(n_pairs)
+
+    def update(self, prices1: np.ndarray, prices2: np.ndarray) -> tuple:
+        """
+        Adds the prices of a new bar, of shape (pairs,), and returns the spreads, hedge ratios and
+        intercepts of the bar, estimated up to the previous bar.
+        """
+        (prices1, prices2) = (np.asarray(prices1, dtype=float), np.asarray(prices2, dtype=float))
+        ratios, intercepts = metrics.update_kalman_state(self.state, prices1, prices2, self.delta,
+                                                         self.observation_variance)
+        return prices1 - prices2 * ratios - intercepts, ratios, intercepts
+
+
+class StreamingSignals:
+    """
+    Spreads, zscores and trading signals of many pairs, updated in constant time per bar, as the live
+    counterpart of the backtest of those pairs.
+    """
+
+    def __init__(self, ratios: np.ndarray, open_at: float = 2.0, close_at: float = 0.0,
+                 window: int = metrics.Z_SCORE_WINDOW, spread_model: str = 'ols') -> None:
+        """
+        :param spread_model: one of metrics.SPREAD_MODELS, 'ols' for the given static hedge ratios or
+        'kalman' for hedge ratios and intercepts updated on every bar
+        :type: str
+        """
+        assert spread_model in metrics.SPREAD_MODELS, \
+            f'Model "{spread_model}" must by one of {list(metrics.SPREAD_MODELS.keys())}'
+
+        self.ratios = np.asarray(ratios, dtype=float)
+        self.open_at = open_at
+        self.close_at = close_at
+        self.kalman = StreamingKalman(len(self.ratios)) if spread_model == 'kalman' else None
+        self.zscore = StreamingZScore(len(self.ratios), window)
+        self.zscores = np.full(len(self.ratios), np.nan)
+        self.signals = np.zeros(len(self.ratios))
+
+    def update(self, prices1: np.ndarray, prices2: np.ndarray) -> np.ndarray:
+        """
+        Adds the prices of a new bar, of shape (pairs,), and returns the signals to hold over the next
+        bar: 1 for long currency1 and short currency2, -1 for the opposite and 0 for no position.
+        Bars without a zscore, as the first window - 1 ones, keep the previous signals.
+        """
+        if self.kalman is None:
+            spreads = metrics.calculate_spread_series(np.asarray(prices1, dtype=float),
+                                                      np.asarray(prices2, dtype=float), self.ratios)
+        else:
+            spreads = self.kalman.update(prices1, prices2)[0]
+        z = self.zscores = self.zscore.update(spreads)
+
+        with np.errstate(invalid='ignore'):
+            buy_signal = (z <= -abs(self.open_at)) | ((self.signals == 1) & (z <= abs(self.close_at)))
+            sell_signal = (z >= abs(self.open_at)) | ((self.signals == -1) & (z >= -abs(self.close_at)))
+
+        signals = np.where(buy_signal, 1.0, np.where(sell_signal, -1.0, 0.0))
+        self.signals = np.where(np.isnan(z), self.signals, signals)
+        return self.signals
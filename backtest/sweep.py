@@ -0,0 +1,119 @@
+from research import Researcher
+from backtest.engine import BacktestEngine
+from backtest import metrics
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+import pandas as pd
+import numpy as np
+import os
+
+PARAMETER_COLUMNS = ['open_at', 'close_at', 'window']
+
+_engine = None
+
+
+def _init_worker(hist_df: pd.DataFrame, researched_df: pd.DataFrame, initial_investment: float,
+                 spread_model: str) -> None:
+    global _engine
+    _engine = BacktestEngine(hist_df, researched_df, initial_investment=initial_investment, spread_model=spread_model)
+
+
+def _run_task(block_number: int, window: int, thresholds: list) -> list:
+    """
+    Backtests a block of pairs for all thresholds of a zscore window, sharing the block spreads,
+    log returns and zscores.
+    """
+    block = _engine.get_block(_engine.blocks[block_number])
+    zscores = _engine.get_zscores(block, window)
+    return [_engine.get_block_stats(block, open_at, close_at, window, zscores=zscores)
+            for (open_at, close_at) in thresholds]
+
+
+class Sweep:
+    """
+    Backtests all researched pairs for many (open_at, close_at, window) settings, computing the spreads
+    and log returns once per pair and the zscores once per window.
+    """
+
+    def __init__(self, research: Researcher, initial_investment: float = 10000, processes: int = None,
+                 spread_model: str = 'ols') -> None:
+        """
+        :param processes: number of processes sharing the sweep, all cpus by default
+        :type: int
+
+        :param spread_model: one of metrics.SPREAD_MODELS, as Backtester.edit_settings
+        :type: str
+        """
+        assert spread_model in metrics.SPREAD_MODELS, \
+            f'Model "{spread_model}" must by one of {list(metrics.SPREAD_MODELS.keys())}'
+
+        self.hist_df = research.hist_df
+        self.researched_df = research.output_df
+        self.initial_investment = initial_investment
+        self.spread_model = spread_model
+        self.results_df = pd.DataFrame()
+        self.__processes = processes
+
+    def grid_search(self, open_at: list = (2,), close_at: list = (0,),
+                    windows: list = (metrics.Z_SCORE_WINDOW,)) -> pd.DataFrame:
+        """
+        Backtests every combination of the given open_at, close_at and zscore windows.
+        """
+        return self.__run_sweep(list(dict.fromkeys(product(open_at, close_at, windows))))
+
+    def random_search(self, n_settings: int, open_at: tuple = (1, 3), close_at: tuple = (-1, 1),
+                      windows: tuple = (10, 60), seed: int = None) -> pd.DataFrame:
+        """
+        Backtests n_settings drawn uniformly from the open_at and close_at (low, high) ranges, and the
+        integer windows (low, high) range, both inclusive.
+        """
+        rng = np.random.default_rng(seed)
+        settings = zip(rng.uniform(*open_at, n_settings).round(2),
+                       rng.uniform(*close_at, n_settings).round(2),
+                       rng.integers(windows[0], windows[1] + 1, n_settings))
+        return self.__run_sweep(list(dict.fromkeys((float(o), float(c), int(w)) for (o, c, w) in settings)))
+
+    def __run_sweep(self, settings: list) -> pd.DataFrame:
+        """
+        Returns the tidy results of every pair with more than one trade, by setting.
+        """
+        windows = list(dict.fromkeys(window for (_, _, window) in settings))
+        thresholds = {window: [(o, c) for (o, c, w) in settings if w == window] for window in windows}
+
+        init_args = (self.hist_df, self.researched_df, self.initial_investment, self.spread_model)
+        _init_worker(*init_args)
+        n_blocks = len(_engine.blocks)
+
+        # The thresholds of each window are split into chunks too, so few blocks and windows with many
+        # thresholds still spread over the processes
+        n_tasks = 4 * (self.__processes or os.cpu_count() or 1)
+        n_chunks = -(-n_tasks // max(1, len(windows) * n_blocks))
+        tasks = [(number, window, chunk) for window in windows for chunk in self.__split(thresholds[window], n_chunks)
+                 for number in range(n_blocks)]
+
+        if self.__processes == 1 or len(tasks) == 0:
+            outputs = [_run_task(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=self.__processes, initializer=_init_worker,
+                                     initargs=init_args) as pool:
+                outputs = list(pool.map(_run_task, *zip(*tasks)))
+
+        stats = {}
+        for (_, window, window_thresholds), task_stats in zip(tasks, outputs):
+            for (open_at, close_at), block_stats in zip(window_thresholds, task_stats):
+                stats.setdefault((open_at, close_at, window), []).append(block_stats)
+
+        results = []
+        for setting in dict.fromkeys(settings):
+            results_df = _engine.get_results(stats.get(setting, []))
+            for column, value in reversed(list(zip(PARAMETER_COLUMNS, setting))):
+                results_df.insert(0, column, value)
+            results.append(results_df)
+
+        self.results_df = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+        return self.results_df
+
+    @staticmethod
+    def __split(thresholds: list, n_chunks: int) -> list:
+        step = -(-len(thresholds) // min(n_chunks, len(thresholds)))
+        return [thresholds[start:start + step] for start in range(0, len(thresholds), step)]
@@ -0,0 +1,165 @@
+from research import Cleaner
+from research import Correlation
+from research import Cointegration
+from research import Metrics
+from backtest.engine import BacktestEngine
+from backtest import metrics
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import pandas as pd
+import numpy as np
+
+HEDGE_RATIOS = ('static', 'rolling')
+
+_shared = {}
+
+
+def _init_worker(name: str, shape: tuple, symbols: list, index: pd.DatetimeIndex, settings: dict) -> None:
+    """
+    Attaches the process to the shared read-only close prices.
+    """
+    memory = shared_memory.SharedMemory(name=name)
+    closes = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+    closes.flags.writeable = False
+    _shared.update({'memory': memory, 'closes': closes, 'symbols': symbols, 'index': index,
+                    'settings': settings})
+
+
+def _close_worker() -> None:
+    memory = _shared.pop('memory', None)
+    _shared.clear()
+    if memory is not None:
+        memory.close()
+
+
+def _run_window(train_start: int, test_start: int, test_end: int) -> pd.DataFrame:
+    """
+    Researches the pairs of the training window, and backtests them on the following test window.
+    """
+    settings = _shared['settings']
+    train_df = Cleaner().get_cleaned_data(_get_hist_df(train_start, test_start))
+    corr_df = Correlation(train_df).get_log_correlation(min_correlation=settings['min_correlation'])
+    coint_df = Cointegration(train_df).filter_by_cointegration(corr_df).get_results()
+    researched_df = Metrics(train_df).apply_metrics(coint_df).filter_by_crossings().get_results()
+
+    # The test window starts with the zscore warm up bars, which are not traded
+    warm_up = settings['window']
+    hist_df = _get_hist_df(test_start - warm_up, test_end)
+    hedge_ratios = None
+    if settings['hedge_ratio'] == 'rolling':
+        hedge_ratios = _get_rolling_hedge_ratios(researched_df, test_start - warm_up, test_end,
+                                                 test_start - train_start)
+
+    engine = BacktestEngine(hist_df, researched_df, initial_investment=settings['initial_investment'],
+                            hedge_ratios=hedge_ratios, first_bar=warm_up)
+    results_df = engine.run(settings['open_at'], settings['close_at'], settings['window'])
+
+    index = _shared['index']
+    results_df.insert(0, 'test_end', index[test_end - 1])
+    results_df.insert(0, 'test_start', index[test_start])
+    results_df.insert(0, 'train_start', index[train_start])
+    return results_df
+
+
+def _get_hist_df(start: int, end: int) -> pd.DataFrame:
+    return pd.DataFrame(_shared['closes'][start:end], index=_shared['index'][start:end],
+                        columns=pd.MultiIndex.from_product([_shared['symbols'], ['close']]), copy=False)
+
+
+def _get_rolling_hedge_ratios(researched_df: pd.DataFrame, start: int, end: int, size: int) -> np.ndarray:
+    """
+    No intercept OLS hedge ratio of each pair over the size bars before each bar t of [start, end), so
+    the window ends at t - 1 and the spread of a bar does not use its own prices, from the differences
+    of the cumulative sums of x * y and y * y.
+    """
+    symbols = pd.Index(_shared['symbols'])
+    closes = _shared['closes'][max(0, start - size):end]
+    prices1 = closes[:, symbols.get_indexer(researched_df['currency1'])]
+    prices2 = closes[:, symbols.get_indexer(researched_df['currency2'])]
+
+    zeros = np.zeros((1, prices1.shape[1]))
+    cum_xy = np.vstack([zeros, np.cumsum(prices1 * prices2, axis=0)])
+    cum_yy = np.vstack([zeros, np.cumsum(prices2 * prices2, axis=0)])
+
+    bars = np.arange(len(closes) - (end - start), len(closes))
+    first_bars = np.maximum(bars - size, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (cum_xy[bars] - cum_xy[first_bars]) / (cum_yy[bars] - cum_yy[first_bars])
+
+
+class WalkForward:
+    """
+    Walk forward research and backtest: the research pipeline selects the pairs of each rolling
+    training window, and they are backtested on the following out of sample window.
+    """
+
+    def __init__(self, hist_df: pd.DataFrame, train_size: int, test_size: int, step: int = None,
+                 min_correlation: float = 0.5, open_at: float = 2, close_at: float = 0,
+                 window: int = metrics.Z_SCORE_WINDOW, hedge_ratio: str = 'static',
+                 initial_investment: float = 10000, processes: int = None) -> None:
+        """
+        :param train_size: number of bars of each training window
+        :type: int
+
+        :param test_size: number of bars of each out of sample window
+        :type: int
+
+        :param step: number of bars between windows, test_size by default
+        :type: int
+
+        :param hedge_ratio: 'static' keeps the hedge ratio of the training window, 'rolling' updates it on
+        every bar over the train_size bars before it
+        :type: str
+
+        :param processes: number of processes running the windows, all cpus by default
+        :type: int
+        """
+        assert hedge_ratio in HEDGE_RATIOS, f'Hedge ratio "{hedge_ratio}" must by one of {list(HEDGE_RATIOS)}'
+        assert train_size > window, 'The training window must be longer than the zscore window'
+
+        self.hist_df = hist_df
+        self.train_size = train_size
+        self.test_size = test_size
+        self.step = step or test_size
+        self.results_df = pd.DataFrame()
+        self.__processes = processes
+        self.__settings = {'min_correlation': min_correlation, 'open_at': open_at, 'close_at': close_at,
+                           'window': window, 'hedge_ratio': hedge_ratio,
+                           'initial_investment': initial_investment}
+
+    def get_windows(self) -> list:
+        """
+        Returns the (train_start, test_start, test_end) bar positions of every window.
+        """
+        n_bars = len(self.hist_df)
+        return [(start, start + self.train_size, min(start + self.train_size + self.test_size, n_bars))
+                for start in range(0, n_bars - self.train_size, self.step)]
+
+    def run(self) -> pd.DataFrame:
+        """
+        Returns the out of sample results of the pairs of every window.
+        """
+        closes_df = self.hist_df.xs('close', axis=1, level=1)
+        memory = shared_memory.SharedMemory(create=True, size=max(1, closes_df.size * 8))
+        try:
+            np.ndarray(closes_df.shape, dtype=np.float64, buffer=memory.buf)[:] = closes_df.to_numpy(dtype=float)
+            init_args = (memory.name, closes_df.shape, list(closes_df.columns), pd.to_datetime(closes_df.index),
+                         self.__settings)
+
+            windows = self.get_windows()
+            if self.__processes == 1 or len(windows) == 0:
+                _init_worker(*init_args)
+                try:
+                    results = [_run_window(*window) for window in windows]
+                finally:
+                    _close_worker()
+            else:
+                with ProcessPoolExecutor(max_workers=self.__processes, initializer=_init_worker,
+                                         initargs=init_args) as pool:
+                    results = list(pool.map(_run_window, *zip(*windows)))
+        finally:
+            memory.close()
+            memory.unlink()
+
+        self.results_df = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+        return self.results_df
@@ -0,0 +1,6 @@
+"""Benchmarks of the Research and Backtest Pipelines
+
+Run with ``python -m benchmarks.run --help``, guard the import time of the packages with
+``python -m benchmarks.imports``, and compare the spread models with ``python -m benchmarks.spreads``.
+
+"""
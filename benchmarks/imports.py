@@ -0,0 +1,48 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# Imports of the startup path of the bot and of cron jobs, e.g. Researcher.load_research and a backtest
+STARTUP_IMPORTS = 'import research, backtest; from research import Researcher; from backtest import Backtester'
+
+# Modules that must only be imported on first use
+LAZY_MODULES = ('ccxt', 'statsmodels', 'matplotlib')
+
+SCRIPT = f'''
+import json, sys, time
+start = time.perf_counter()
+{STARTUP_IMPORTS}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [m for m in {LAZY_MODULES!r} if m in sys.modules]}}))
+'''
+
+
+def measure(repeat: int = 5) -> dict:
+    """
+    Returns the best import time of the startup path over fresh interpreters, and the lazy modules
+    it loaded.
+    """
+    runs = [json.loads(subprocess.run([sys.executable, '-c', SCRIPT], capture_output=True, text=True,
+                                      check=True).stdout) for _ in range(repeat)]
+    return {'seconds': min(run['seconds'] for run in runs), 'loaded': runs[0]['loaded']}
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Guards the import time of the research and backtest packages.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=1.0, help='fails above this import time')
+    options = parser.parse_args(args)
+
+    result = measure(options.repeat)
+    print(f"startup imports: {result['seconds']:.3f}s, lazy modules loaded: {result['loaded'] or 'none'}")
+
+    if result['loaded']:
+        print(f"REGRESSION {', '.join(result['loaded'])} imported at startup")
+    if result['seconds'] > options.max_seconds:
+        print(f"REGRESSION {result['seconds']:.3f}s above {options.max_seconds:.3f}s")
+    return 1 if result['loaded'] or result['seconds'] > options.max_seconds else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
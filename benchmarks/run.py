@@ -0,0 +1,133 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from research import Researcher, Cleaner, Correlation, Cointegration, Metrics
+from backtest import Backtester
+from backtest import metrics
+from backtest import signals
+from benchmarks.synthetic import generate_market, get_recall_precision
+
+STAGES = ['cleaner', 'correlation', 'cointegration', 'metrics', 'signals', 'backtest']
+
+
+def measure(function, memory: bool = True) -> tuple:
+    """
+    Returns the result, wall seconds and peak traced bytes of a function. The peak memory comes from a
+    second, traced run, so the tracing does not slow down the timed one.
+    """
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+
+    peak_bytes = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result, seconds, peak_bytes
+
+
+def run_pipeline(n_symbols: int, n_bars: int, n_pairs: int, min_correlation: float, seed: int,
+                 memory: bool = True) -> list:
+    hist_df, planted = generate_market(n_symbols=n_symbols, n_bars=n_bars, n_pairs=n_pairs, seed=seed)
+    size = {'n_symbols': n_symbols, 'n_bars': n_bars}
+    records = []
+
+    def record(stage, function, n_in, get_n_out):
+        result, seconds, peak_bytes = measure(function, memory)
+        records.append({'stage': stage, **size, 'seconds': seconds, 'peak_bytes': peak_bytes,
+                        'n_in': n_in, 'n_out': get_n_out(result)})
+        return result
+
+    cleaned_df = record('cleaner', lambda: Cleaner().get_cleaned_data(hist_df), n_symbols, lambda df: df.shape[1])
+    corr_df = record('correlation', lambda: Correlation(cleaned_df).get_log_correlation(min_correlation),
+                     cleaned_df.shape[1], len)
+    coint_df = record('cointegration', lambda: Cointegration(cleaned_df).filter_by_cointegration(corr_df.copy()
+                                                                                                 ).get_results(),
+                      len(corr_df), len)
+    output_df = record('metrics', lambda: Metrics(cleaned_df).apply_metrics(coint_df.copy()).filter_by_crossings(
+                       ).get_results(), len(coint_df), len)
+
+    zscores = [metrics.calculate_zscore_series(metrics.calculate_spread_series(
+               cleaned_df[currency1], cleaned_df[currency2], ratio))
+               for currency1, currency2, ratio in zip(output_df.currency1, output_df.currency2, output_df.ratio)]
+    record('signals', lambda: [signals.set_signals(zscore) for zscore in zscores], len(zscores), len)
+
+    research = Researcher()
+    (research.hist_df, research.output_df) = (hist_df, output_df)
+
+    def run_backtests():
+        backtester = Backtester(research)
+        backtester.run_backtests()
+        return backtester.results_df
+
+    record('backtest', run_backtests, len(output_df), len)
+
+    recall, precision = get_recall_precision(output_df, planted)
+    records.append({'stage': 'screening', **size, 'n_planted': len(planted), 'recall': recall,
+                    'precision': precision})
+    return records
+
+
+def get_regressions(records: list, baseline: list, max_slowdown: float) -> list:
+    """
+    Returns the stages that got slower than max_slowdown times their baseline time for the same size.
+    """
+    key = lambda record: (record['stage'], record['n_symbols'], record['n_bars'])
+    baseline_seconds = {key(record): record['seconds'] for record in baseline if 'seconds' in record}
+    return [{**record, 'baseline_seconds': baseline_seconds[key(record)]} for record in records
+            if key(record) in baseline_seconds and record['seconds'] > max_slowdown * baseline_seconds[key(record)]]
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Times and memory profiles each research and backtest stage '
+                                                 'over synthetic markets.')
+    parser.add_argument('--symbols', type=int, nargs='+', default=[50], help='e.g. 50 500 2000')
+    parser.add_argument('--bars', type=int, nargs='+', default=[1000], help='e.g. 1000 50000 500000')
+    parser.add_argument('--pairs', type=int, default=5, help='planted cointegrated pairs')
+    parser.add_argument('--min-correlation', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced memory runs')
+    parser.add_argument('--output', default='./data/benchmarks/results.json')
+    parser.add_argument('--baseline', help='results of a previous run to check for regressions')
+    parser.add_argument('--max-slowdown', type=float, default=1.5)
+    options = parser.parse_args(args)
+
+    records = []
+    for n_symbols in options.symbols:
+        for n_bars in options.bars:
+            records += run_pipeline(n_symbols, n_bars, min(options.pairs, n_symbols // 2), options.min_correlation,
+                                    options.seed, memory=not options.no_memory)
+
+    report = {'meta': {'date': datetime.now().isoformat(), 'python': platform.python_version(),
+                       'numpy': np.__version__, 'pandas': pd.__version__, 'machine': platform.machine()},
+              'results': records}
+    os.makedirs(os.path.dirname(os.path.abspath(options.output)), exist_ok=True)
+    with open(options.output, 'w') as file:
+        json.dump(report, file, indent=2)
+
+    print(pd.DataFrame(records).to_string(index=False))
+
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = get_regressions(records, json.load(file)['results'], options.max_slowdown)
+        for regression in regressions:
+            print(f"REGRESSION {regression['stage']} ({regression['n_symbols']} symbols, {regression['n_bars']} bars): "
+                  f"{regression['seconds']:.3f}s against {regression['baseline_seconds']:.3f}s")
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
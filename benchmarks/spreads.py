@@ -0,0 +1,57 @@
+import argparse
+import sys
+import time
+import numpy as np
+from backtest import metrics
+from backtest.streaming import StreamingKalman
+
+
+def measure(n_pairs: int = 500, n_bars: int = 5000, repeat: int = 3, seed: int = 0) -> list:
+    """
+    Returns the best time and the throughput, in pair bars per second, of the spreads of every spread
+    model over (bars, pairs) random walk prices, and of the bar by bar Kalman updates.
+    """
+    rng = np.random.default_rng(seed)
+    prices2 = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, (n_bars, n_pairs)), axis=0))
+    prices1 = prices2 * rng.uniform(0.5, 2, n_pairs) + rng.normal(0, 1, (n_bars, n_pairs))
+    ratios = np.einsum('tp,tp->p', prices1, prices2) / np.einsum('tp,tp->p', prices2, prices2)
+
+    def run_streaming():
+        kalman = StreamingKalman(n_pairs)
+        for bar in range(n_bars):
+            kalman.update(prices1[bar], prices2[bar])
+
+    runs = {f'{model} batch': (lambda model=model: metrics.calculate_model_spread_array(prices1, prices2, ratios,
+                                                                                       model))
+            for model in metrics.SPREAD_MODELS}
+    runs['kalman streaming'] = run_streaming
+
+    results = []
+    for name, run in runs.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        results.append({'model': name, 'seconds': min(times), 'pair_bars_per_second': n_pairs * n_bars / min(times)})
+    return results
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Compares the throughput of the spread models.')
+    parser.add_argument('--pairs', type=int, default=500)
+    parser.add_argument('--bars', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    options = parser.parse_args(args)
+
+    results = measure(options.pairs, options.bars, options.repeat, options.seed)
+    baseline = results[0]['seconds']
+    for result in results:
+        print(f"{result['model']:>18}: {result['seconds']:.4f}s, {result['pair_bars_per_second']:,.0f} pair bars/s, "
+              f"{result['seconds'] / baseline:.1f}x ols")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
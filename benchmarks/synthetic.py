@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# Number of bars of each closed form step of the AR(1) series
+AR_BLOCK = 64
+
+
+def get_ar_series(noise: np.ndarray, phi: float) -> np.ndarray:
+    """
+    Returns the AR(1) series x[t] = phi * x[t - 1] + noise[t], starting from 0, in closed form over
+    blocks of AR_BLOCK bars, whose powers of phi stay well within the float range.
+    """
+    powers = phi ** np.arange(AR_BLOCK)
+    series = np.empty(len(noise))
+    last = 0.0
+    for start in range(0, len(noise), AR_BLOCK):
+        block = noise[start:start + AR_BLOCK]
+        block_powers = powers[:len(block)]
+        series[start:start + len(block)] = block_powers * (phi * last + np.cumsum(block / block_powers))
+        last = series[start + len(block) - 1]
+    return series
+
+
+def generate_market(n_symbols: int = 50, n_bars: int = 1000, n_pairs: int = 5, young_fraction: float = 0.1,
+                    timeframe: str = '1h', seed: int = 0) -> tuple:
+    """
+    Generates a reproducible panel of close prices, as the historical data of a Researcher, with
+    planted cointegrated pairs, random walks sharing a market factor and young symbols whose history
+    starts after the first bar.
+
+    :param n_pairs: number of planted cointegrated pairs, each of them takes two symbols
+    :type: int
+
+    :param young_fraction: fraction of the remaining symbols with missing history
+    :type: float
+
+    :return: (hist_df, planted pairs as a list of (currency1, currency2))
+    """
+    assert 2 * n_pairs <= n_symbols, 'Each planted pair needs two symbols'
+
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2020-01-01', periods=n_bars, freq=pd.Timedelta(timeframe))
+    symbols = [f'SYM{i:04d}/USDT' for i in range(n_symbols)]
+
+    market = np.cumsum(rng.normal(0, 0.01, n_bars))
+    betas = rng.uniform(0, 1.5, n_symbols)
+    log_prices = market[:, None] * betas + np.cumsum(rng.normal(0, 0.02, (n_bars, n_symbols)), axis=0) + \
+        np.log(rng.uniform(0.1, 100, n_symbols))
+    closes = np.exp(log_prices)
+
+    # Each planted pair follows its second currency times a ratio, plus a mean reverting AR(1) spread
+    planted = []
+    for pair in range(n_pairs):
+        (leg1, leg2) = (2 * pair, 2 * pair + 1)
+        ratio = rng.uniform(0.5, 5)
+        noise = rng.normal(0, 0.02 * closes[:, leg2].mean() * ratio, n_bars)
+        spread = get_ar_series(noise, 0.8)
+        closes[:, leg1] = np.maximum(ratio * closes[:, leg2] + spread, 1e-8)
+        planted.append((symbols[leg1], symbols[leg2]))
+
+    others = np.arange(2 * n_pairs, n_symbols)
+    young = rng.choice(others, size=int(len(others) * young_fraction), replace=False)
+    for symbol in young:
+        closes[:rng.integers(1, n_bars // 2 + 1), symbol] = np.nan
+
+    hist_df = pd.DataFrame(closes, index=index, columns=pd.MultiIndex.from_product([symbols, ['close']]))
+    return hist_df, planted
+
+
+def get_recall_precision(output_df: pd.DataFrame, planted: list) -> tuple:
+    """
+    Returns the fraction of planted pairs that were found, and the fraction of found pairs that were
+    planted.
+    """
+    found = {frozenset(pair) for pair in zip(output_df['currency1'], output_df['currency2'])}
+    planted = {frozenset(pair) for pair in planted}
+    hits = len(found & planted)
+    return (hits / len(planted) if planted else np.nan, hits / len(found) if found else np.nan)
@@ -6,9 +6,34 @@
 
 __version__ = '1.0.0'
 
-from research.loader import Loader
-from research.cleaner import Cleaner
-from research.correlation import Correlation
-from research.cointegration import Cointegration
-from research.metrics import Metrics
-from research.researcher import Researcher
+import importlib
+
+# Classes are imported on first use, so importing the package does not import ccxt or statsmodels
+_MODULES = {'CandleStore': 'research.candles',
+            'ResultCache': 'research.cache',
+            'Resampler': 'research.resampler',
+            'Loader': 'research.loader',
+            'Cleaner': 'research.cleaner',
+            'ClusterIndex': 'research.clustering',
+            'Correlation': 'research.correlation',
+            'Cointegration': 'research.cointegration',
+            'Metrics': 'research.metrics',
+            'PanelStore': 'research.panel',
+            'IncrementalResearch': 'research.incremental',
+            'Instrumentation': 'research.instrumentation',
+            'Researcher': 'research.researcher'}
+
+__all__ = list(_MODULES)
+
+
+def __getattr__(name: str):
+    if name not in _MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_MODULES[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from typing import Iterator
+import numpy as np
+
+CACHE_KINDS = ('coint', 'metrics', 'backtest')
+
+# Seconds a connection waits for the other processes writing to the same cache file
+CONNECT_TIMEOUT = 60
+
+
+class ResultCache:
+    """
+    On-disk per pair results, keyed by a hash of the pair prices and of the parameters that produced
+    them, so pairs whose data and settings did not change are not computed again.
+
+    The results are small rows, so they are kept in a single SQLite file rather than a file per pair.
+    """
+
+    def __init__(self, path: str = './data/cache/results.sqlite', max_bytes: int = 2 ** 28) -> None:
+        """
+        :param path: SQLite file of the cached results
+        :type: str
+
+        :param max_bytes: size of the cached results above which the least recently used are evicted
+        :type: int
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.__connect() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, kind TEXT, '
+                               'symbol1 TEXT, symbol2 TEXT, value TEXT, size INTEGER, last_used REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+
+    def get_keys(self, kind: str, values: np.ndarray, positions1: np.ndarray, positions2: np.ndarray,
+                 pair_params: np.ndarray = None, **params) -> list:
+        """
+        Returns the key of each (positions1, positions2) pair of columns of values.
+
+        :param pair_params: parameter of each pair, e.g. its hedge ratio
+        :type: np.ndarray
+
+        :param params: parameters shared by all pairs, e.g. the zscore window
+        """
+        assert kind in CACHE_KINDS, f'Kind "{kind}" must by one of {list(CACHE_KINDS)}'
+
+        digests = {position: hashlib.sha256(np.ascontiguousarray(values[:, position])).hexdigest()
+                   for position in np.unique(np.concatenate([positions1, positions2]))}
+        common = f"{kind}|{json.dumps(params, sort_keys=True, default=str)}"
+        pair_params = [''] * len(positions1) if pair_params is None else [repr(float(p)) for p in pair_params]
+
+        return [hashlib.sha256(f'{common}|{digests[p1]}|{digests[p2]}|{p}'.encode()).hexdigest()
+                for (p1, p2, p) in zip(positions1, positions2, pair_params)]
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Returns the cached values of the given keys, by key, and marks them as recently used.
+        """
+        found = {}
+        with self.__connect() as connection:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = connection.execute(f"SELECT key, value FROM results WHERE key IN ({','.join('?' * len(chunk))})",
+                                          chunk).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            connection.executemany('UPDATE results SET last_used = ? WHERE key = ?',
+                                   [(time.time(), key) for key in found])
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, kind: str, keys: list, values: list, currencies1: list, currencies2: list) -> None:
+        """
+        Caches the values of each key, e.g. [coint_t, p_value, critical_value], with the symbols of its
+        pair, then evicts.
+        """
+        now = time.time()
+        rows = []
+        for key, pair_values, symbol1, symbol2 in zip(keys, values, currencies1, currencies2):
+            value = json.dumps([float(v) for v in pair_values])
+            rows.append((key, kind, symbol1, symbol2, value, len(key) + len(value), now))
+
+        with self.__connect() as connection:
+            connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        self.evict()
+
+    def get_or_compute(self, kind: str, keys: list, currencies1: list, currencies2: list, compute) -> tuple:
+        """
+        Returns the value columns of every key, calling compute(missing) for the positions of the keys
+        that are not cached only, and caching its results.
+
+        :param compute: function of an array of key positions, returning a tuple of value columns
+        :type: function
+        """
+        cached = self.get_many(keys)
+        missing = np.array([i for i, key in enumerate(keys) if key not in cached], dtype=int)
+        computed = compute(missing)
+        if len(missing) > 0:
+            self.set_many(kind, [keys[i] for i in missing], list(zip(*computed)),
+                          [currencies1[i] for i in missing], [currencies2[i] for i in missing])
+
+        cached_rows = [cached[key] for key in keys if key in cached]
+        is_cached = np.ones(len(keys), dtype=bool)
+        is_cached[missing] = False
+
+        columns = tuple(np.empty(len(keys), dtype=column.dtype) for column in computed)
+        for position, (column, computed_column) in enumerate(zip(columns, computed)):
+            column[missing] = computed_column
+            column[is_cached] = [row[position] for row in cached_rows]
+        return columns
+
+    def invalidate(self, kind: str = None, symbols: list = None) -> int:
+        """
+        Removes the cached results of a kind and/or of the pairs with any of the given symbols, or all
+        of them, and returns the number of removed results.
+        """
+        (conditions, args) = ([], [])
+        if kind is not None:
+            conditions.append('kind = ?')
+            args.append(kind)
+        if symbols is not None:
+            marks = ','.join('?' * len(symbols))
+            conditions.append(f'(symbol1 IN ({marks}) OR symbol2 IN ({marks}))')
+            args += list(symbols) * 2
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self.__connect() as connection:
+            return connection.execute(f'DELETE FROM results{where}', args).rowcount
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used results until the cache fits in max_bytes, and returns the
+        number of removed results.
+        """
+        with self.__connect() as connection:
+            total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total_size <= self.max_bytes:
+                return 0
+
+            evicted = []
+            for key, size in connection.execute('SELECT key, size FROM results ORDER BY last_used'):
+                if total_size <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                total_size -= size
+            connection.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+        return len(evicted)
+
+    @contextmanager
+    def __connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Yields a connection committed on success and always closed. The write-ahead log lets the
+        processes sharing the cache read while another one writes.
+        """
+        with closing(sqlite3.connect(self.path, timeout=CONNECT_TIMEOUT)) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            with connection:
+                yield connection
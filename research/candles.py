@@ -0,0 +1,147 @@
+import json
+import os
+import shutil
+import numpy as np
+
+# Columns of the stored candles, the time is kept in epoch milliseconds
+OHLCV_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+
+class CandleStore:
+    """
+    On-disk candles by exchange, timeframe and symbol, as ./<exchange>/<timeframe>/<symbol>.npy arrays
+    of OHLCV_COLUMNS sorted by time.
+    """
+
+    def __init__(self, directory: str = './data/raw/candles', max_bytes: int = 2 ** 30) -> None:
+        """
+        :param directory: root of the stored candles
+        :type: str
+
+        :param max_bytes: size of the store above which the least recently used timeframes are evicted, or
+        None to never evict, e.g. when several processes share the store
+        :type: int
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def read(self, exchange: str, symbol: str, timeframe: str) -> np.ndarray:
+        path = self.__get_path(exchange, symbol, timeframe)
+        if not os.path.exists(path):
+            return np.empty((0, len(OHLCV_COLUMNS)))
+
+        return self.__get_unique(np.load(path))
+
+    def get_since(self, exchange: str, symbol: str, timeframe: str):
+        """
+        Returns the earliest time from which the stored candles are complete, or None.
+        """
+        path = self.__get_meta_path(exchange, symbol, timeframe)
+        if not os.path.exists(path):
+            return None
+
+        with open(path) as file:
+            return json.load(file)['since']
+
+    def append(self, exchange: str, symbol: str, timeframe: str, candles: np.ndarray, since: int = None) -> np.ndarray:
+        """
+        Merges new candles into the stored ones, newer candles replacing stored candles of the same
+        time, and returns all the stored candles.
+
+        :param since: time from which the appended candles were fully fetched
+        :type: int
+        """
+        candles = np.asarray(candles, dtype=float).reshape(-1, len(OHLCV_COLUMNS))
+        merged = self.__get_unique(np.concatenate([self.read(exchange, symbol, timeframe), candles]))
+
+        path = self.__get_path(exchange, symbol, timeframe)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.__save(path, merged)
+
+        stored_since = self.get_since(exchange, symbol, timeframe)
+        if since is not None and (stored_since is None or since < stored_since):
+            with open(self.__get_meta_path(exchange, symbol, timeframe), 'w') as file:
+                json.dump({'since': int(since)}, file)
+
+        return merged
+
+    def check_integrity(self, exchange: str, symbol: str, timeframe: str) -> dict:
+        """
+        Returns the number of duplicated and unsorted candles in the stored file, and the (start, end)
+        times of the missing candles.
+        """
+        import ccxt
+
+        path = self.__get_path(exchange, symbol, timeframe)
+        times = np.load(path)[:, 0] if os.path.exists(path) else np.empty(0)
+        unique_times = np.unique(times)
+
+        step = ccxt.Exchange.parse_timeframe(timeframe) * 1000
+        gaps = np.nonzero(np.diff(unique_times) > step)[0]
+
+        return {'duplicates': len(times) - len(unique_times),
+                'unsorted': int(np.count_nonzero(np.diff(times) < 0)),
+                'gaps': [(int(unique_times[i] + step), int(unique_times[i + 1] - step)) for i in gaps]}
+
+    def evict(self, keep: tuple = ()) -> list:
+        """
+        Removes the least recently used timeframes until the store fits in max_bytes.
+
+        :param keep: (exchange, timeframe) pairs that can not be evicted
+        :type: tuple
+
+        :return: evicted (exchange, timeframe) pairs
+        """
+        if self.max_bytes is None:
+            return []
+
+        timeframes = []
+        for exchange in self.__list_dirs(self.directory):
+            for timeframe in self.__list_dirs(os.path.join(self.directory, exchange)):
+                path = os.path.join(self.directory, exchange, timeframe)
+                files = [os.path.join(path, name) for name in os.listdir(path)]
+                last_used = max([os.path.getmtime(file) for file in files], default=0)
+                size = sum(os.path.getsize(file) for file in files)
+                timeframes.append((last_used, size, exchange, timeframe))
+
+        total_size = sum(size for (_, size, _, _) in timeframes)
+        evicted = []
+        for (_, size, exchange, timeframe) in sorted(timeframes):
+            if total_size <= self.max_bytes:
+                break
+
+            if (exchange, timeframe) not in keep:
+                shutil.rmtree(os.path.join(self.directory, exchange, timeframe))
+                total_size -= size
+                evicted.append((exchange, timeframe))
+
+        return evicted
+
+    @staticmethod
+    def __get_unique(candles: np.ndarray) -> np.ndarray:
+        # The last candle of a time wins, as it is the most recently fetched
+        reversed_times = candles[::-1, 0]
+        _, positions = np.unique(reversed_times, return_index=True)
+        return candles[::-1][positions]
+
+    @staticmethod
+    def __save(path: str, candles: np.ndarray) -> None:
+        temporary_path = f'{path}.tmp.npy'
+        np.save(temporary_path, candles)
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def __list_dirs(path: str) -> list:
+        if not os.path.isdir(path):
+            return []
+        return [name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name))]
+
+    def __get_path(self, exchange: str, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.directory, exchange, timeframe, f"{self.__get_file_name(symbol)}.npy")
+
+    def __get_meta_path(self, exchange: str, symbol: str, timeframe: str) -> str:
+        return os.path.join(self.directory, exchange, timeframe, f"{self.__get_file_name(symbol)}.json")
+
+    @staticmethod
+    def __get_file_name(symbol: str) -> str:
+        return symbol.replace('/', '_').replace(':', '-')
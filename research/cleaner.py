@@ -1,20 +1,92 @@
 import pandas as pd
+import numpy as np
+
+
+def get_validity_index(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Returns the first_bar and last_bar positions of the valid prices of each column, and its number
+    of bars between them, or -1, -1 and 0 for the columns without any valid price.
+    """
+    is_valid = df.notna().to_numpy()
+    has_valid = is_valid.any(axis=0)
+    first_bars = np.where(has_valid, is_valid.argmax(axis=0), -1)
+    last_bars = np.where(has_valid, len(is_valid) - 1 - is_valid[::-1].argmax(axis=0), -1)
+    return pd.DataFrame({'first_bar': first_bars, 'last_bar': last_bars,
+                         'n_bars': np.where(has_valid, last_bars - first_bars + 1, 0)}, index=df.columns)
+
+
+def get_pair_windows(validity_df: pd.DataFrame, positions1: np.ndarray, positions2: np.ndarray) -> tuple:
+    """
+    Returns the [start, end) bars of the overlapping valid prices of each pair of columns.
+    """
+    (first_bars, last_bars) = (validity_df['first_bar'].to_numpy(), validity_df['last_bar'].to_numpy())
+    starts = np.maximum(first_bars[positions1], first_bars[positions2])
+    ends = np.minimum(last_bars[positions1], last_bars[positions2]) + 1
+    return starts, np.maximum(ends, starts)
+
+
+def get_window_groups(starts: np.ndarray, ends: np.ndarray) -> list:
+    """
+    Groups the pairs by common window, so each group is computed at once, and returns the (start, end,
+    pair positions) of each group.
+    """
+    if len(starts) == 0:
+        return []
+    windows, groups = np.unique(np.stack([starts, ends], axis=1), axis=0, return_inverse=True)
+    return [(int(start), int(end), np.flatnonzero(groups.ravel() == group))
+            for group, (start, end) in enumerate(windows)]
 
 
 class Cleaner:
+    def __init__(self, min_overlap: int = None) -> None:
+        """
+        :param min_overlap: keep the symbols listed after the first bar, and only pair the symbols with at
+        least min_overlap bars in common, or None to remove every symbol missing any bar
+        :type: int
+        """
+        self.min_overlap = min_overlap
+        self.validity_df = pd.DataFrame(columns=['first_bar', 'last_bar', 'n_bars'])
+
     @staticmethod
     def fill_missing_data(df: pd.DataFrame) -> pd.DataFrame:
         return df.fillna(method='ffill')
 
     def get_cleaned_data(self, hist_df: pd.DataFrame) -> pd.DataFrame:
-        return self.__remove_young_currencies(self.__get_data_close(hist_df))
+        closes_df = self.__get_data_close(hist_df)
+        if self.min_overlap is None:
+            cleaned_df = self.__remove_young_currencies(closes_df)
+        else:
+            cleaned_df = self.__remove_short_currencies(closes_df, self.min_overlap)
+        self.validity_df = get_validity_index(cleaned_df)
+        return cleaned_df
+
+    def get_overlap_mask(self) -> np.ndarray:
+        """
+        Returns the (symbols, symbols) mask of the pairs of the cleaned data with at least min_overlap
+        bars in common.
+        """
+        first_bars = self.validity_df['first_bar'].to_numpy()
+        last_bars = self.validity_df['last_bar'].to_numpy()
+        overlaps = np.minimum.outer(last_bars, last_bars) - np.maximum.outer(first_bars, first_bars) + 1
+        return overlaps >= (self.min_overlap or 0)
 
     @staticmethod
     def __get_data_close(df: pd.DataFrame) -> pd.DataFrame:
-        closes_df = df.loc[:, df.columns.get_level_values(1).isin(['close'])]
+        # Panels holding only closes, as the loaded columnar ones, are not copied
+        is_close = df.columns.get_level_values(1).isin(['close'])
+        closes_df = df.copy(deep=False) if is_close.all() else df.loc[:, is_close]
         closes_df.columns = closes_df.columns.droplevel(1)
         return closes_df
 
     @staticmethod
     def __remove_young_currencies(df: pd.DataFrame) -> pd.DataFrame:
-        return df.dropna(how='any', axis=1)
+        is_complete = df.notna().all()
+        return df if is_complete.all() else df.loc[:, is_complete]
+
+    @staticmethod
+    def __remove_short_currencies(df: pd.DataFrame, min_overlap: int) -> pd.DataFrame:
+        """
+        Removes the symbols with less than min_overlap valid bars, which can not overlap enough with any other.
+        """
+        is_long = (get_validity_index(df)['n_bars'] >= max(2, min_overlap)).to_numpy()
+        return df if is_long.all() else df.loc[:, is_long]
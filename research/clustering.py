@@ -0,0 +1,145 @@
+import pandas as pd
+import numpy as np
+
+# Number of factors of the log returns embedding of the symbols
+N_COMPONENTS = 8
+
+
+class ClusterIndex:
+    """
+    Candidate pairs index: clusters the symbols on a low rank factor embedding of their log returns,
+    and only keeps the pairs within a cluster or between neighbouring clusters, so the correlation and
+    cointegration stages do not screen all the pairs of symbols.
+    """
+
+    def __init__(self, n_clusters: int = None, n_neighbours: int = 1, n_components: int = N_COMPONENTS,
+                 seed: int = 0) -> None:
+        """
+        :param n_clusters: number of clusters, about the square root of the number of symbols by default
+        :type: int
+
+        :param n_neighbours: number of nearest clusters of each cluster whose pairs are also candidates.
+        This is the recall knob: more neighbours keep more of the pairs a full scan finds, for more
+        candidates, up to all pairs with n_neighbours >= n_clusters - 1
+        :type: int
+
+        :param n_components: number of factors of the embedding
+        :type: int
+
+        :param seed: seed of the embedding and of the clustering
+        :type: int
+        """
+        assert n_neighbours >= 0, 'The number of neighbouring clusters must be positive'
+        self.n_clusters = n_clusters
+        self.n_neighbours = n_neighbours
+        self.n_components = n_components
+        self.seed = seed
+        self.cleaned_df = pd.DataFrame()
+        self.labels = np.empty(0, dtype=int)
+        self.candidates = np.empty((0, 0), dtype=bool)
+
+    def fit(self, cleaned_df: pd.DataFrame) -> 'ClusterIndex':
+        """
+        Clusters the symbols of the cleaned prices and builds the (symbols, symbols) mask of the
+        candidate pairs.
+        """
+        self.cleaned_df = cleaned_df
+        n_symbols = cleaned_df.shape[1]
+        n_clusters = min(n_symbols, self.n_clusters or max(1, int(round(np.sqrt(n_symbols)))))
+        embedding = self.__get_embedding(cleaned_df)
+
+        if n_clusters <= 1 or embedding.shape[1] == 0:
+            self.labels = np.zeros(n_symbols, dtype=int)
+            adjacency = np.ones((1, 1), dtype=bool)
+        else:
+            # sklearn is only imported by the researches that are prefiltered
+            from sklearn.cluster import KMeans
+            kmeans = KMeans(n_clusters=n_clusters, n_init=4, random_state=self.seed).fit(embedding)
+            self.labels = kmeans.labels_
+            adjacency = self.__get_adjacency(kmeans.cluster_centers_)
+
+        self.candidates = adjacency[np.ix_(self.labels, self.labels)]
+        np.fill_diagonal(self.candidates, False)
+        return self
+
+    def __get_embedding(self, cleaned_df: pd.DataFrame) -> np.ndarray:
+        """
+        Unit norm loadings of each symbol on the first factors of its standardized log returns, so the
+        distance of two symbols shrinks as the correlation of their returns grows.
+        """
+        prices = cleaned_df.to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            log_returns = np.log(prices[1:] / prices[:-1])
+            standardized = np.nan_to_num((log_returns - np.nanmean(log_returns, axis=0)) /
+                                         np.nanstd(log_returns, axis=0))
+
+        n_components = min(self.n_components, standardized.shape[0] - 1, standardized.shape[1] - 1)
+        if n_components < 1:
+            return np.empty((standardized.shape[1], 0))
+
+        from sklearn.decomposition import TruncatedSVD
+        embedding = TruncatedSVD(n_components=n_components, random_state=self.seed).fit_transform(standardized.T)
+        norms = np.linalg.norm(embedding, axis=1, keepdims=True)
+        return np.divide(embedding, norms, out=np.zeros_like(embedding), where=norms > 0)
+
+    def __get_adjacency(self, centers: np.ndarray) -> np.ndarray:
+        """
+        Returns the (clusters, clusters) mask of each cluster and of its n_neighbours nearest clusters,
+        made symmetric.
+        """
+        distances = np.linalg.norm(centers[:, None, :] - centers[None, :, :], axis=2)
+        nearest = np.argsort(distances, axis=1, kind='stable')[:, :self.n_neighbours + 1]
+
+        adjacency = np.zeros(distances.shape, dtype=bool)
+        np.put_along_axis(adjacency, nearest, True, axis=1)
+        np.fill_diagonal(adjacency, True)
+        return adjacency | adjacency.T
+
+    def get_candidate_pairs(self) -> pd.DataFrame:
+        """
+        Returns the currency1, currency2 and cluster of each candidate pair, with currency1 before
+        currency2 in the cleaned prices.
+        """
+        rows, columns = np.nonzero(np.triu(self.candidates, k=1))
+        symbols = self.cleaned_df.columns
+        return pd.DataFrame({'currency1': symbols[rows], 'currency2': symbols[columns],
+                             'cluster1': self.labels[rows], 'cluster2': self.labels[columns]})
+
+    def get_n_candidates(self) -> int:
+        return int(np.count_nonzero(self.candidates)) // 2
+
+    def get_recall_report(self, min_correlation: float, cache=None) -> dict:
+        """
+        Runs the full correlation and cointegration scan of all pairs, and reports how many of the
+        cointegrated pairs the candidate index keeps and misses.
+
+        :param cache: cached cointegration results, shared with the research
+        :type: ResultCache
+        """
+        from research import Correlation
+        from research import Cointegration
+
+        corr_df = Correlation(self.cleaned_df).get_log_correlation(min_correlation=min_correlation)
+        coint_df = Cointegration(self.cleaned_df, cache=cache).filter_by_cointegration(corr_df).get_results()
+
+        symbols = self.cleaned_df.columns
+        is_correlated_kept = self.__is_candidate(symbols, corr_df)
+        is_kept = self.__is_candidate(symbols, coint_df)
+        n_symbols = len(symbols)
+
+        return {'n_symbols': n_symbols,
+                'n_clusters': int(self.labels.max()) + 1 if n_symbols > 0 else 0,
+                'n_pairs': n_symbols * (n_symbols - 1) // 2,
+                'n_candidates': self.get_n_candidates(),
+                'n_correlated': len(corr_df),
+                'n_correlated_kept': int(np.count_nonzero(is_correlated_kept)),
+                'n_cointegrated': len(coint_df),
+                'n_cointegrated_kept': int(np.count_nonzero(is_kept)),
+                'n_missed': int(np.count_nonzero(~is_kept)),
+                'recall': float(np.mean(is_kept)) if len(coint_df) > 0 else 1.0,
+                'missed_df': coint_df[~is_kept].reset_index(drop=True)}
+
+    def __is_candidate(self, symbols: pd.Index, pairs_df: pd.DataFrame) -> np.ndarray:
+        positions1 = symbols.get_indexer(pairs_df['currency1'])
+        positions2 = symbols.get_indexer(pairs_df['currency2'])
+        return self.candidates[positions1, positions2]
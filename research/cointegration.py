@@ -1,21 +1,70 @@
+import os
 import pandas as pd
 import numpy as np
-import statsmodels.tsa.stattools as ts
-import statsmodels.api as sm
+from concurrent.futures import ProcessPoolExecutor
+from research.cache import ResultCache
+from research.cleaner import get_validity_index, get_pair_windows, get_window_groups
+
+COINT_METHODS = ('batch', 'exact')
+
+# Max number of floats held by the lagged ADF design of a block of pairs
+BLOCK_SIZE = 2 ** 22
+
+SQRTEPS = np.sqrt(np.finfo(np.double).eps)
+
+_shared_values = np.empty((0, 0))
+
+
+def _init_worker(values: np.ndarray) -> None:
+    global _shared_values
+    _shared_values = values
+
+
+def _apply_coint(position1: int, position2: int, start: int, end: int) -> tuple:
+    import statsmodels.tsa.stattools as ts
+    coint_res = ts.coint(_shared_values[start:end, position1], _shared_values[start:end, position2])
+    return coint_res[0], coint_res[1], coint_res[2][0]
 
 
 class Cointegration:
-    def __init__(self, cleaned_df: pd.DataFrame):
+    def __init__(self, cleaned_df: pd.DataFrame, method: str = 'batch', processes: int = None,
+                 cache: ResultCache = None):
+        """
+        :param method: 'batch' runs every Engle-Granger test at once with matrix operations,
+        'exact' runs statsmodels coint for each pair across a process pool
+        :type: str
+
+        :param processes: number of processes of the 'exact' method, all cpus by default
+        :type: int
+
+        :param cache: cached test results, so only the pairs with new prices are tested
+        :type: ResultCache
+        """
+        assert method in COINT_METHODS, f'Method "{method}" must by one of {list(COINT_METHODS)}'
+
         self.cleaned_df = cleaned_df
         self.output_df = pd.DataFrame()
+        self.__method = method
+        self.__processes = processes
+        self.__cache = cache
 
     def filter_by_cointegration(self, corr: pd.DataFrame) -> pd.DataFrame:
         self.output_df = self.__select_coint_pairs(corr)
         return self
 
     def __select_coint_pairs(self, corr: pd.DataFrame) -> pd.DataFrame:
-        coint_t, p_value, critical_value = \
-            np.vectorize(self.__apply_coint)(corr['currency1'], corr['currency2'])
+        positions1 = self.cleaned_df.columns.get_indexer(corr['currency1'])
+        positions2 = self.cleaned_df.columns.get_indexer(corr['currency2'])
+
+        coint = self.__batch_coint if self.__method == 'batch' else self.__exact_coint
+        if self.__cache is None:
+            coint_t, p_value, critical_value = coint(positions1, positions2)
+        else:
+            keys = self.__cache.get_keys('coint', self.cleaned_df.to_numpy(), positions1, positions2,
+                                         method=self.__method)
+            coint_t, p_value, critical_value = self.__cache.get_or_compute(
+                'coint', keys, list(corr['currency1']), list(corr['currency2']),
+                lambda missing: coint(positions1[missing], positions2[missing]))
 
         corr['coint_t'] = coint_t
         corr['p_value'] = p_value
@@ -24,14 +73,122 @@ class Cointegration:
         return corr[(corr['p_value'] < 0.5) & (corr['coint_t'] < corr['criticals'])
                     ].drop(columns=['p_value', 'coint_t', 'criticals'])
 
-    def __apply_coint(self, currency1, currency2):
-        coint_res = ts.coint(self.cleaned_df[currency1], self.cleaned_df[currency2])
+    def __exact_coint(self, positions1: np.ndarray, positions2: np.ndarray) -> tuple:
+        values = self.cleaned_df.to_numpy(dtype=float)
+        if len(positions1) == 0:
+            return np.empty(0), np.empty(0), np.empty(0)
+        starts, ends = get_pair_windows(get_validity_index(self.cleaned_df), positions1, positions2)
+
+        if self.__processes == 1:
+            _init_worker(values)
+            results = list(map(_apply_coint, positions1, positions2, starts, ends))
+        else:
+            chunksize = max(1, len(positions1) // (4 * (self.__processes or os.cpu_count() or 1)))
+            with ProcessPoolExecutor(max_workers=self.__processes, initializer=_init_worker,
+                                     initargs=(values,)) as pool:
+                results = list(pool.map(_apply_coint, positions1, positions2, starts, ends, chunksize=chunksize))
 
-        coint_t = coint_res[0]
-        p_value = coint_res[1]
-        critical_value = coint_res[2][0]
+        return tuple(np.array(column, dtype=float) for column in zip(*results))
 
+    def __batch_coint(self, positions1: np.ndarray, positions2: np.ndarray) -> tuple:
+        """
+        Engle-Granger test of every pair over its overlapping bars, as statsmodels coint with a constant
+        and the ADF lag length selected by AIC. The pairs sharing the same bars are tested at once.
+        """
+        # statsmodels is imported on first use, as it takes longer to import than the test of many pairs
+        from statsmodels.tsa.adfvalues import mackinnoncrit, mackinnonp
+
+        values = self.cleaned_df.to_numpy()
+        (coint_t, critical_value) = (np.full(len(positions1), np.nan), np.full(len(positions1), np.nan))
+        starts, ends = get_pair_windows(get_validity_index(self.cleaned_df), positions1, positions2)
+
+        for (start, end, pairs) in get_window_groups(starts, ends):
+            n_obs = end - start
+            max_lag = min(n_obs // 2 - 1, int(np.ceil(12.0 * np.power(n_obs / 100.0, 1 / 4.0))))
+            if max_lag < 0:
+                continue
+
+            # Only the prices of the tested pairs are converted to float64, e.g. from float32 panels
+            resid, rsquared = self.__get_coint_residuals(values[start:end, positions1[pairs]].astype(float),
+                                                         values[start:end, positions2[pairs]].astype(float))
+
+            block = max(1, BLOCK_SIZE // (n_obs * (max_lag + 1)))
+            adf_t = np.concatenate([self.__get_adf_stats(resid[:, i:i + block], max_lag)
+                                    for i in range(0, resid.shape[1], block)] or [np.empty(0)])
+
+            coint_t[pairs] = np.where(rsquared < 1 - 100 * SQRTEPS, adf_t, -np.inf)
+            critical_value[pairs] = mackinnoncrit(N=2, regression='c', nobs=n_obs - 1)[0]
+
+        p_value = np.array([mackinnonp(t, regression='c', N=2) if not np.isnan(t) else np.nan for t in coint_t],
+                           dtype=float)
         return coint_t, p_value, critical_value
 
+    @staticmethod
+    def __get_coint_residuals(y0: np.ndarray, y1: np.ndarray) -> tuple:
+        demeaned0 = y0 - y0.mean(axis=0)
+        demeaned1 = y1 - y1.mean(axis=0)
+        beta = (demeaned0 * demeaned1).sum(axis=0) / (demeaned1 * demeaned1).sum(axis=0)
+        resid = demeaned0 - demeaned1 * beta
+        rsquared = 1 - (resid * resid).sum(axis=0) / (demeaned0 * demeaned0).sum(axis=0)
+        return resid, rsquared
+
+    def __get_adf_stats(self, resid: np.ndarray, max_lag: int) -> np.ndarray:
+        """
+        ADF t-stats without trend of a block of residual columns.
+        """
+        # Lag search over the same observations for comparable AIC
+        endog, exog = self.__get_adf_design(resid, max_lag, max_lag)
+        n_obs = endog.shape[1]
+        gram, moments = self.__get_moments(endog, exog)
+        aic = np.full((max_lag + 1, resid.shape[1]), np.inf)
+        for lag in range(max_lag + 1):
+            ssr = self.__fit_ols(endog, exog[..., :lag + 1], gram[:, :lag + 1, :lag + 1],
+                                 moments[:, :lag + 1])[0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                llf = -n_obs / 2 * (np.log(2 * np.pi) + np.log(ssr / n_obs) + 1)
+            aic[lag] = np.where(np.isnan(llf), np.inf, -2 * llf + 2 * (lag + 1))
+        best_lags = aic.argmin(axis=0)
+
+        # Refit with the best lag over all of its available observations
+        adf_t = np.empty(resid.shape[1])
+        for lag in np.unique(best_lags):
+            columns = best_lags == lag
+            endog, exog = self.__get_adf_design(resid[:, columns], lag, lag)
+            gram, moments = self.__get_moments(endog, exog)
+            ssr, params = self.__fit_ols(endog, exog, gram, moments)
+            scale = ssr / (endog.shape[1] - (lag + 1))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                adf_t[columns] = params[:, 0] / np.sqrt(scale * np.linalg.pinv(gram)[:, 0, 0])
+
+        return adf_t
+
+    @staticmethod
+    def __get_adf_design(resid: np.ndarray, start: int, n_lags: int) -> tuple:
+        """
+        Returns the differences (pairs, obs) regressed on the lagged level and n_lags lagged
+        differences (pairs, obs, 1 + n_lags), starting after the first start differences.
+        """
+        diffs = np.diff(resid, axis=0)
+        n_obs = len(diffs) - start
+        exog = np.empty((resid.shape[1], n_obs, n_lags + 1))
+        exog[..., 0] = resid[start:-1].T
+        for lag in range(1, n_lags + 1):
+            exog[..., lag] = diffs[start - lag:len(diffs) - lag].T
+        return np.ascontiguousarray(diffs[start:].T), exog
+
+    @staticmethod
+    def __get_moments(endog: np.ndarray, exog: np.ndarray) -> tuple:
+        exog_t = exog.transpose(0, 2, 1)
+        return exog_t @ exog, exog_t @ endog[..., None]
+
+    @staticmethod
+    def __fit_ols(endog: np.ndarray, exog: np.ndarray, gram: np.ndarray, moments: np.ndarray) -> tuple:
+        try:
+            params = np.linalg.solve(gram, moments)
+        except np.linalg.LinAlgError:
+            params = np.linalg.pinv(gram) @ moments
+        resid = endog - (exog @ params)[..., 0]
+        return np.einsum('pt,pt->p', resid, resid), params[..., 0]
+
     def get_results(self):
         return self.output_df
@@ -1,30 +1,162 @@
 import pandas as pd
 import numpy as np
 
+PAIRS_DTYPE = np.dtype([('i', np.int32), ('j', np.int32), ('correlation', np.float64)])
+
+# Max number of correlations held by a block of columns
+BLOCK_SIZE = 2 ** 22
+
+# Number of bars of each chunk of log returns in the chunked correlations
+CHUNK_ROWS = 2 ** 16
+
 
 class Correlation:
-    def __init__(self, cleaned_df: pd.DataFrame):
+    def __init__(self, cleaned_df: pd.DataFrame, chunk_rows: int = None, candidates: np.ndarray = None):
+        """
+        :param chunk_rows: accumulate the correlations over chunks of chunk_rows bars in float64, so only
+        one chunk of float64 log returns is held at once, e.g. for float32 panels, or None to
+        standardize all log returns at once
+        :type: int
+
+        :param candidates: (columns, columns) mask of the pairs to screen, e.g. of a ClusterIndex, or None
+        to screen all pairs
+        :type: np.ndarray
+        """
         self.cleaned_df = cleaned_df
+        self.__chunk_rows = chunk_rows
+        self.__candidates = candidates
 
     def get_log_correlation(self, min_correlation: float) -> pd.DataFrame:
-        corr_df = pd.DataFrame(
-            self.__get_highest_df(self.__get_unstacked_df(self.__get_corr_df(self.__get_log_df(self.cleaned_df))),
-                                  min_correlation)).reset_index()
-        corr_df.columns = ['currency1', 'currency2', 'correlation']
+        pairs = self.get_correlated_pairs(min_correlation)
+        columns = self.cleaned_df.columns
+        corr_df = pd.DataFrame({'currency1': columns[pairs['i']],
+                                'currency2': columns[pairs['j']],
+                                'correlation': pairs['correlation']})
         return corr_df
 
+    def get_correlated_pairs(self, min_correlation: float) -> np.ndarray:
+        """
+        Walks the upper triangle of the log returns correlation matrix in blocks of columns, and
+        returns only the (i, j, correlation) of the candidate pairs at or above min_correlation, with i < j.
+        """
+        if self.__chunk_rows is not None:
+            n_columns = self.cleaned_df.shape[1]
+            (get_block, values) = (self.__get_chunked_block, self.__get_chunked_means())
+        else:
+            log_returns = self.__get_log_df(self.cleaned_df).to_numpy(dtype=float)[1:]
+            n_columns = log_returns.shape[1]
+            get_block = self.__get_complete_block if not np.isnan(log_returns).any() else self.__get_pairwise_block
+            values = self.__standardize(log_returns)
+        block = max(1, BLOCK_SIZE // max(1, n_columns))
+
+        pairs = [np.empty(0, dtype=PAIRS_DTYPE)]
+        for start in range(0, n_columns, block):
+            end = min(start + block, n_columns)
+            corr = self.__get_candidate_corr(get_block(values, start, end), start)
+            pairs.append(self.__get_highest_pairs(corr, start, min_correlation))
+
+        return np.concatenate(pairs)
+
+    def __get_chunks(self) -> list:
+        n_bars = len(self.cleaned_df)
+        return [slice(start, min(start + self.__chunk_rows, n_bars)) for start in range(1, n_bars, self.__chunk_rows)]
+
+    @staticmethod
+    def __get_chunk_log_returns(prices: np.ndarray, rows: slice) -> np.ndarray:
+        (current, previous) = (prices[rows].astype(float), prices[rows.start - 1:rows.stop - 1].astype(float))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.log(current / previous)
+
+    def __get_chunked_means(self) -> np.ndarray:
+        """
+        Column means of the log returns, from float64 sums accumulated chunk by chunk.
+        """
+        prices = self.cleaned_df.to_numpy()
+        (sums, counts) = (np.zeros(prices.shape[1]), np.zeros(prices.shape[1]))
+        for rows in self.__get_chunks():
+            log_returns = self.__get_chunk_log_returns(prices, rows)
+            sums += np.nansum(log_returns, axis=0)
+            counts += np.count_nonzero(~np.isnan(log_returns), axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+    def __get_chunked_block(self, means: np.ndarray, start: int, end: int) -> np.ndarray:
+        """
+        Pairwise complete correlations of the columns [start, end) with the columns [start, n), as pandas
+        corr, from float64 sums of the log returns centered by their means, accumulated chunk by chunk,
+        so only one block of sums is held at once.
+        """
+        prices = self.cleaned_df.to_numpy()
+        (n, sum_x, sum_y, xy, xx, yy) = (np.zeros((end - start, prices.shape[1] - start)) for _ in range(6))
+        for rows in self.__get_chunks():
+            log_returns = self.__get_chunk_log_returns(prices[:, start:], rows) - means[start:]
+            mask = (~np.isnan(log_returns)).astype(float)
+            values = np.nan_to_num(log_returns)
+            (x, mask_x) = (values[:, :end - start], mask[:, :end - start])
+            n += mask_x.T @ mask
+            sum_x += x.T @ mask
+            sum_y += mask_x.T @ values
+            xy += x.T @ values
+            xx += (x * x).T @ mask
+            yy += mask_x.T @ (values * values)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = xy - sum_x * sum_y / n
+            var_x = xx - sum_x * sum_x / n
+            var_y = yy - sum_y * sum_y / n
+            return np.where(n > 1, cov / np.sqrt(var_x * var_y), np.nan)
+
+    def __get_candidate_corr(self, corr: np.ndarray, start: int) -> np.ndarray:
+        """
+        Drops the correlations of the pairs that are not candidates from a block of columns [start, n).
+        """
+        if self.__candidates is None:
+            return corr
+        return np.where(self.__candidates[start:start + corr.shape[0], start:], corr, np.nan)
+
     @staticmethod
     def __get_log_df(df: pd.DataFrame) -> pd.DataFrame:
         return np.log(df.pct_change() + 1)
 
     @staticmethod
-    def __get_corr_df(df: pd.DataFrame) -> pd.DataFrame:
-        return df.corr()
+    def __standardize(log_returns: np.ndarray) -> np.ndarray:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            demeaned = log_returns - np.nanmean(log_returns, axis=0)
+            return demeaned / np.sqrt(np.nansum(demeaned * demeaned, axis=0))
 
     @staticmethod
-    def __get_unstacked_df(df: pd.DataFrame) -> pd.DataFrame:
-        return df.unstack().drop_duplicates()
+    def __get_complete_block(standardized: np.ndarray, start: int, end: int) -> np.ndarray:
+        """
+        Correlations of the columns [start, end) with the columns [start, n).
+        """
+        return standardized[:, start:end].T @ standardized[:, start:]
 
     @staticmethod
-    def __get_highest_df(df: pd.DataFrame, min_correlation: float) -> pd.DataFrame:
-        return df[(df < 1) & (df >= min_correlation)]
+    def __get_pairwise_block(standardized: np.ndarray, start: int, end: int) -> np.ndarray:
+        """
+        Same as __get_complete_block, but each pair only uses the rows where both columns are valid,
+        as pandas corr does.
+        """
+        mask = (~np.isnan(standardized)).astype(float)
+        values = np.nan_to_num(standardized)
+        (x, mask_x, y, mask_y) = (values[:, start:end], mask[:, start:end], values[:, start:], mask[:, start:])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            n = mask_x.T @ mask_y
+            sum_x = x.T @ mask_y
+            sum_y = mask_x.T @ y
+            cov = x.T @ y - sum_x * sum_y / n
+            var_x = (x * x).T @ mask_y - sum_x * sum_x / n
+            var_y = mask_x.T @ (y * y) - sum_y * sum_y / n
+            return np.where(n > 1, cov / np.sqrt(var_x * var_y), np.nan)
+
+    @staticmethod
+    def __get_highest_pairs(corr: np.ndarray, start: int, min_correlation: float) -> np.ndarray:
+        with np.errstate(invalid='ignore'):
+            rows, columns = np.nonzero(np.triu((corr < 1) & (corr >= min_correlation), k=1))
+
+        pairs = np.empty(len(rows), dtype=PAIRS_DTYPE)
+        pairs['i'] = rows + start
+        pairs['j'] = columns + start
+        pairs['correlation'] = corr[rows, columns]
+        return pairs
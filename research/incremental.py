@@ -0,0 +1,156 @@
+import pandas as pd
+import numpy as np
+from research.cache import ResultCache
+from research.cointegration import Cointegration
+from research.metrics import Metrics
+
+
+class IncrementalResearch:
+    """
+    Keeps the sums behind the correlations and hedge ratios of every pair of symbols, so each refresh
+    of the cleaned data only costs the bars that were added, dropped or revised, and only reruns the
+    cointegration tests of the pairs whose correlation or hedge ratio moved past a tolerance. The hedge
+    ratios and zero crossings of the cointegrated pairs are computed again over the whole data, in one
+    batch. The bars before the last one of the previous data are taken as final.
+    """
+
+    def __init__(self, min_correlation: float, tolerance: float = 0.01, cache: ResultCache = None) -> None:
+        """
+        :param min_correlation: e.g. '0.83' is 83%
+        :type: float
+
+        :param tolerance: absolute correlation change, or relative hedge ratio change, above which the
+        cointegration of a pair is tested again
+        :type: float
+
+        :param cache: cached cointegration results of the moved pairs, and hedge ratios and zero crossings
+        :type: ResultCache
+        """
+        self.min_correlation = min_correlation
+        self.tolerance = tolerance
+        self.cache = cache
+        self.cleaned_df = pd.DataFrame()
+        self.output_df = pd.DataFrame()
+        self.n_tests = 0
+
+    def update(self, cleaned_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Refreshes the research with the new cleaned data, and returns the same output as Researcher.
+        """
+        if not cleaned_df.columns.equals(self.cleaned_df.columns):
+            self.__reset(cleaned_df)
+        else:
+            self.__update_sums(cleaned_df)
+        self.cleaned_df = cleaned_df
+
+        corr_df = self.__get_corr_df()
+        (positions1, positions2) = self.__get_positions(corr_df)
+        is_cointegrated = self.__get_cointegrated(corr_df, positions1, positions2)
+
+        coint_df = corr_df[is_cointegrated].copy()
+        self.output_df = Metrics(cleaned_df, cache=self.cache).apply_metrics(coint_df).filter_by_crossings(
+            ).get_results()
+        return self.output_df
+
+    def __reset(self, cleaned_df: pd.DataFrame) -> None:
+        n_symbols = cleaned_df.shape[1]
+        self.__n_returns = 0
+        self.__returns_sum = np.zeros(n_symbols)
+        self.__returns_gram = np.zeros((n_symbols, n_symbols))
+        self.__prices_gram = np.zeros((n_symbols, n_symbols))
+
+        # Correlation and hedge ratio of each pair at its last cointegration test
+        self.__tested_corr = np.full((n_symbols, n_symbols), np.nan)
+        self.__tested_ratio = np.full((n_symbols, n_symbols), np.nan)
+        self.__is_cointegrated = np.zeros((n_symbols, n_symbols), dtype=bool)
+
+        self.cleaned_df = pd.DataFrame(columns=cleaned_df.columns, dtype=float)
+        self.__update_sums(cleaned_df)
+
+    def __update_sums(self, cleaned_df: pd.DataFrame) -> None:
+        """
+        Removes the first bars of the previous data that are gone and its last bar if it was revised, and
+        adds the new or revised bars, only reading the bars from the last previous one onward.
+        """
+        (old_df, new_df) = (self.cleaned_df, cleaned_df)
+        n_dropped = old_df.index.searchsorted(new_df.index[0]) if len(new_df) > 0 else len(old_df)
+        old_start = max(n_dropped, len(old_df) - 1)
+        new_start = new_df.index.searchsorted(old_df.index[old_start]) if old_start < len(old_df) else 0
+
+        (removed_prices, added_prices) = self.__get_changed_rows(old_df.iloc[old_start:], new_df.iloc[new_start:])
+        removed_prices = np.vstack([old_df.iloc[:n_dropped].to_numpy(dtype=float), removed_prices])
+        self.__prices_gram += added_prices.T @ added_prices - removed_prices.T @ removed_prices
+
+        # The first bar of each data has no log return
+        (removed_returns, added_returns) = self.__get_changed_rows(
+            self.__get_log_df(old_df, max(old_start, n_dropped + 1)), self.__get_log_df(new_df, max(new_start, 1)))
+        removed_returns = np.vstack([self.__get_log_df(old_df, 1, min(n_dropped, len(old_df) - 1) + 1
+                                                       ).to_numpy(dtype=float), removed_returns])
+        self.__n_returns += len(added_returns) - len(removed_returns)
+        self.__returns_sum += added_returns.sum(axis=0) - removed_returns.sum(axis=0)
+        self.__returns_gram += added_returns.T @ added_returns - removed_returns.T @ removed_returns
+
+    @staticmethod
+    def __get_changed_rows(old_df: pd.DataFrame, new_df: pd.DataFrame) -> tuple:
+        common = old_df.index.intersection(new_df.index)
+        old_common = old_df.loc[common].to_numpy(dtype=float)
+        new_common = new_df.loc[common].to_numpy(dtype=float)
+        is_revised = (old_common != new_common).any(axis=1)
+
+        removed = np.vstack([old_df.loc[old_df.index.difference(common)].to_numpy(dtype=float),
+                             old_common[is_revised]])
+        added = np.vstack([new_df.loc[new_df.index.difference(common)].to_numpy(dtype=float),
+                           new_common[is_revised]])
+        return removed, added
+
+    @staticmethod
+    def __get_log_df(df: pd.DataFrame, start: int, end: int = None) -> pd.DataFrame:
+        """
+        Log returns of the bars [start, end) of the prices, start being at least 1.
+        """
+        end = len(df) if end is None else end
+        prices = df.iloc[start - 1:max(start - 1, end)].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return pd.DataFrame(np.log(prices[1:] / prices[:-1]), index=df.index[start:end])
+
+    def __get_corr_df(self) -> pd.DataFrame:
+        n = self.__n_returns
+        cov = n * self.__returns_gram - np.outer(self.__returns_sum, self.__returns_sum)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = cov / np.sqrt(np.outer(np.diag(cov), np.diag(cov)))
+            rows, columns = np.nonzero(np.triu((corr < 1) & (corr >= self.min_correlation), k=1))
+
+        symbols = self.cleaned_df.columns
+        return pd.DataFrame({'currency1': symbols[rows], 'currency2': symbols[columns],
+                             'correlation': corr[rows, columns]})
+
+    def __get_positions(self, pairs_df: pd.DataFrame) -> tuple:
+        return (self.cleaned_df.columns.get_indexer(pairs_df['currency1']),
+                self.cleaned_df.columns.get_indexer(pairs_df['currency2']))
+
+    def __get_ratio(self, positions1: np.ndarray, positions2: np.ndarray) -> np.ndarray:
+        # No intercept OLS of the first prices on the second ones, as Metrics
+        return self.__prices_gram[positions1, positions2] / self.__prices_gram[positions2, positions2]
+
+    def __get_cointegrated(self, corr_df: pd.DataFrame, positions1: np.ndarray, positions2: np.ndarray) -> np.ndarray:
+        """
+        Tests again the cointegration of the pairs that moved, and returns whether each pair is cointegrated.
+        """
+        corr = corr_df['correlation'].to_numpy()
+        ratio = self.__get_ratio(positions1, positions2)
+
+        tested_corr = self.__tested_corr[positions1, positions2]
+        tested_ratio = self.__tested_ratio[positions1, positions2]
+        is_moved = ~(np.abs(corr - tested_corr) <= self.tolerance) | \
+            ~(np.abs(ratio / tested_ratio - 1) <= self.tolerance)
+
+        moved_df = corr_df[is_moved].copy()
+        passed_df = Cointegration(self.cleaned_df, cache=self.cache).filter_by_cointegration(moved_df).get_results()
+        self.n_tests += len(moved_df)
+
+        (moved1, moved2) = (positions1[is_moved], positions2[is_moved])
+        self.__tested_corr[moved1, moved2] = corr[is_moved]
+        self.__tested_ratio[moved1, moved2] = ratio[is_moved]
+        self.__is_cointegrated[moved1, moved2] = moved_df.index.isin(passed_df.index)
+
+        return self.__is_cointegrated[positions1, positions2]
@@ -0,0 +1,113 @@
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+import pandas as pd
+import numpy as np
+
+SUMMARY_COLUMNS = ['stage', 'wall_seconds', 'cpu_seconds', 'peak_bytes', 'n_in', 'n_out']
+
+
+class Instrumentation:
+    """
+    Opt-in timings, peak memory, cardinalities and profiles of the research and backtest stages.
+    Disabled instrumentation records nothing, so the pipelines can always go through it.
+    """
+
+    def __init__(self, enabled: bool = True, memory: bool = True, profile: bool = False) -> None:
+        """
+        :param memory: trace the peak memory of each stage, which slows the stages down
+        :type: bool
+
+        :param profile: capture a cProfile of each stage
+        :type: bool
+        """
+        self.enabled = enabled
+        self.memory = memory
+        self.profile = profile
+        self.records = []
+        self.pair_times = {}
+        self.profiles = {}
+
+    @contextmanager
+    def stage(self, name: str, n_in: int = None):
+        """
+        Measures the wall time, the cpu time of this process and the peak memory of the block it wraps.
+        The yielded record takes the output cardinality, e.g. record['n_out'] = len(corr_df).
+        """
+        record = {'stage': name, 'n_in': n_in, 'n_out': None}
+        if not self.enabled:
+            yield record
+            return
+
+        is_tracing = self.memory and not tracemalloc.is_tracing()
+        if is_tracing:
+            tracemalloc.start()
+        elif self.memory:
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile() if self.profile else None
+
+        (wall, cpu) = (time.perf_counter(), time.process_time())
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.profiles[name] = profiler
+            record['wall_seconds'] = time.perf_counter() - wall
+            record['cpu_seconds'] = time.process_time() - cpu
+            record['peak_bytes'] = tracemalloc.get_traced_memory()[1] if self.memory else None
+            if is_tracing:
+                tracemalloc.stop()
+            self.records.append(record)
+
+    def add_pair_time(self, name: str, seconds: float) -> None:
+        if self.enabled:
+            self.pair_times.setdefault(name, []).append(seconds)
+
+    def get_histograms(self, bins: int = 10) -> dict:
+        """
+        Returns the histogram and percentiles of the per pair timings of each stage.
+        """
+        histograms = {}
+        for name, times in self.pair_times.items():
+            times = np.asarray(times)
+            counts, edges = np.histogram(times, bins=bins)
+            histograms[name] = {'n_pairs': len(times), 'mean': times.mean(),
+                                'p50': np.percentile(times, 50), 'p95': np.percentile(times, 95),
+                                'max': times.max(), 'counts': counts.tolist(), 'edges': edges.tolist()}
+        return histograms
+
+    def get_summary(self) -> pd.DataFrame:
+        return pd.DataFrame(self.records, columns=SUMMARY_COLUMNS)
+
+    def get_profile_stats(self, name: str, n_lines: int = 20, sort_by: str = 'cumulative') -> str:
+        stream = io.StringIO()
+        pstats.Stats(self.profiles[name], stream=stream).sort_stats(sort_by).print_stats(n_lines)
+        return stream.getvalue()
+
+    def save_report(self, path: str = './data/outputs/instrumentation.json') -> None:
+        """
+        Saves the stage records and the per pair histograms as JSON, and each profile next to it as
+        {path without extension}_{stage}.prof.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        report = {'date': datetime.now().isoformat(), 'stages': self.records,
+                  'pair_times': self.get_histograms()}
+        with open(path, 'w') as file:
+            json.dump(report, file, indent=2, default=float)
+
+        for name, profiler in self.profiles.items():
+            profiler.dump_stats(f'{os.path.splitext(path)[0]}_{name}.prof')
+
+    def clear(self) -> None:
+        self.records = []
+        self.pair_times = {}
+        self.profiles = {}
@@ -1,19 +1,65 @@
+import asyncio
+import time
 import ccxt
+import ccxt.async_support as ccxt_async
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 # from datetime import date
 from datetime import timedelta
 import pandas as pd
+import numpy as np
+from research.candles import CandleStore
+from research.resampler import Resampler
+
+# Seconds to wait before retrying a failed request, doubled on each new attempt
+RETRY_BACKOFF = 1.0
+
+
+class Throttle:
+    """
+    Spaces the requests shared by concurrent downloads according to the exchange rate limit.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.__interval = interval
+        self.__next_slot = 0.0
+        self.__lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self.__lock:
+            now = time.monotonic()
+            delay = self.__next_slot - now
+            self.__next_slot = max(now, self.__next_slot) + self.__interval
+
+        if delay > 0:
+            await asyncio.sleep(delay)
 
 
 class Loader:
 
-    def __init__(self, exchange: str, fiat: str = 'USDT') -> None:
-        exchange_class = getattr(ccxt, exchange)
-        self.__client = exchange_class({
+    def __init__(self, exchange: str, fiat: str = 'USDT', client=None, async_client=None,
+                 max_concurrency: int = 10, retries: int = 3, store: CandleStore = None, dtype=np.float64) -> None:
+        """
+        :param client: ccxt-like exchange object used instead of a new ccxt client, e.g. a fake
+        exchange for offline runs
+        :param async_client: same as client for concurrent downloads, with coroutine methods
+        :param max_concurrency: max number of requests in flight on concurrent downloads
+        :param retries: max number of retries of a request after a network error
+        :param store: local candles, so only the candles after the stored ones are fetched
+        :param dtype: dtype of the loaded OHLCV values, e.g. np.float32 for compact panels
+        """
+        self.__client = client or getattr(ccxt, exchange)({
             'enableRateLimit': True,
             # 'options': {'defaultType': 'future'},
         })
+        self.__async_client = async_client
+        self.__exchange = exchange
+        self.__max_concurrency = max_concurrency
+        self.__retries = retries
+        self.__store = store
         self.__fiat = fiat
+        self.__dtype = dtype
+        self.integrity = {}
         self.symbols = self.__get_symbols()
         self.timeframe = str
         self.interval = str
@@ -26,24 +72,71 @@ class Loader:
         # Get only coins that has futures available #
         return [s for s in self.__client.symbols if ':' not in s and f"{s}:{self.__fiat}" in self.__client.symbols]
 
-    def new_historical_data(self, timeframe: str, interval: str) -> pd.DataFrame:
+    def new_historical_data(self, timeframe: str, interval: str, concurrent: bool = False,
+                            base_timeframe: str = None) -> pd.DataFrame:
         """
-        :param timeframe: e.g. '1d', '4h', '3S', '15m' 
+        :param timeframe: e.g. '1d', '4h', '3S', '15m'
         :type: str
-        
+
         :param interval: e.g. '1 year ago', '3 months ago', '10days ago'
         :type: str
+
+        :param concurrent: download the symbols concurrently with the ccxt async client
+        :type: bool
+
+        :param base_timeframe: download this finer timeframe instead, e.g. '15m', and aggregate it locally
+        :type: str
         """
+        if base_timeframe is not None and base_timeframe != timeframe:
+            return self.new_resampler(base_timeframe, interval, concurrent).resample(timeframe)
 
         self.timeframe = timeframe
         self.interval = interval
 
-        return self.__set_data_merge(self.__get_multi_data())
+        data = self.__run(self.__get_multi_data_async()) if concurrent else self.__get_multi_data()
+
+        if self.__store is not None:
+            self.__store.evict(keep=((self.__exchange, timeframe),))
+
+        return self.__set_data_merge(data)
+
+    def new_resampler(self, base_timeframe: str, interval: str, concurrent: bool = False) -> Resampler:
+        """
+        Downloads the base timeframe once, and returns the Resampler deriving the coarser ones from it.
+        """
+        return Resampler(self.new_historical_data(base_timeframe, interval, concurrent), base_timeframe)
 
     def __get_multi_data(self) -> list:
         since = self.__get_start_date_from_interval(self.__get_days(self.__get_digit()))
         return [self.__get_single_data(symbol, self.timeframe, since) for symbol in self.symbols]
 
+    async def __get_multi_data_async(self) -> list:
+        since = self.__get_start_date_from_interval(self.__get_days(self.__get_digit()))
+
+        # Requests are spaced by our own throttle, shared by all the concurrent downloads
+        client = self.__async_client or getattr(ccxt_async, self.__exchange)({'enableRateLimit': False})
+        semaphore = asyncio.Semaphore(self.__max_concurrency)
+        throttle = Throttle(getattr(client, 'rateLimit', 0) / 1000)
+
+        try:
+            return await asyncio.gather(*[self.__get_single_data_async(client, semaphore, throttle, symbol,
+                                                                       self.timeframe, since)
+                                          for symbol in self.symbols])
+        finally:
+            if self.__async_client is None:
+                await client.close()
+
+    @staticmethod
+    def __run(coroutine):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+
+        # Notebooks already run an event loop, so the download gets its own thread
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, coroutine).result()
+
     def __get_digit(self):
         return [int(s) for s in self.interval.split() if s.isdigit()][0]
 
@@ -57,13 +150,101 @@ class Loader:
         return int((datetime.now() - timedelta(days=days)).timestamp()) * 1000
 
     def __get_single_data(self, symbol, timeframe, since) -> pd.DataFrame:
-        frame = pd.DataFrame(self.__client.fetch_ohlcv(symbol, timeframe, since=since))
+        candles = []
+        until = self.__get_now()
+        fetch_since = page_since = self.__get_fetch_since(symbol, timeframe, since)
+        while page_since is not None:
+            page = self.__fetch_page(symbol, timeframe, page_since)
+            candles += page
+            page_since = self.__get_next_since(page, page_since, until, timeframe)
+
+        return self.__get_frame(self.__store_candles(symbol, timeframe, candles, since, fetch_since))
+
+    async def __get_single_data_async(self, client, semaphore, throttle, symbol, timeframe, since) -> pd.DataFrame:
+        candles = []
+        until = self.__get_now()
+        fetch_since = page_since = self.__get_fetch_since(symbol, timeframe, since)
+        while page_since is not None:
+            async with semaphore:
+                page = await self.__fetch_page_async(client, throttle, symbol, timeframe, page_since)
+            candles += page
+            page_since = self.__get_next_since(page, page_since, until, timeframe)
+
+        return self.__get_frame(self.__store_candles(symbol, timeframe, candles, since, fetch_since))
+
+    def __get_fetch_since(self, symbol, timeframe, since) -> int:
+        """
+        Returns the time of the last stored candle when the store is complete from the requested since,
+        as it may have been stored before its close, even when it is older than since so no hole is
+        left between the stored and the fetched candles. Returns the requested since otherwise, e.g.
+        when the stored candles miss some bars of the requested window.
+        """
+        if self.__store is None:
+            return since
+
+        stored_since = self.__store.get_since(self.__exchange, symbol, timeframe)
+        stored = self.__store.read(self.__exchange, symbol, timeframe)
+        if stored_since is None or stored_since > since or len(stored) == 0:
+            return since
+
+        gaps = self.__store.check_integrity(self.__exchange, symbol, timeframe)['gaps']
+        if any(end >= since for (_, end) in gaps):
+            return since
+
+        return int(stored[-1, 0])
+
+    def __store_candles(self, symbol, timeframe, candles, since, fetch_since) -> list:
+        if self.__store is None:
+            return candles
+
+        is_full_fetch = fetch_since == since
+        stored = self.__store.append(self.__exchange, symbol, timeframe, candles,
+                                     since=since if is_full_fetch else None)
+        self.integrity[symbol] = self.__store.check_integrity(self.__exchange, symbol, timeframe)
+        return stored[stored[:, 0] >= since].tolist()
+
+    def __fetch_page(self, symbol, timeframe, since) -> list:
+        for attempt in range(self.__retries + 1):
+            try:
+                return self.__client.fetch_ohlcv(symbol, timeframe, since=since)
+            except ccxt.NetworkError:
+                if attempt == self.__retries:
+                    raise
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    async def __fetch_page_async(self, client, throttle, symbol, timeframe, since) -> list:
+        for attempt in range(self.__retries + 1):
+            await throttle.wait()
+            try:
+                return await client.fetch_ohlcv(symbol, timeframe, since=since)
+            except ccxt.NetworkError:
+                if attempt == self.__retries:
+                    raise
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    @staticmethod
+    def __get_now() -> int:
+        return int(datetime.now().timestamp()) * 1000
+
+    @staticmethod
+    def __get_next_since(page: list, since: int, until: int, timeframe: str):
+        """
+        Returns the start of the next page, or None once the requested window is covered.
+        """
+        if len(page) == 0:
+            return None
+
+        next_since = page[-1][0] + ccxt.Exchange.parse_timeframe(timeframe) * 1000
+        return next_since if since < next_since <= until else None
+
+    def __get_frame(self, candles: list) -> pd.DataFrame:
+        frame = pd.DataFrame(candles)
         if len(frame) > 0:
             frame = frame.iloc[:, :6]
             frame.columns = ['time', 'open', 'high', 'low', 'close', 'volume']
-            frame = frame.set_index('time')
-            frame.index = pd.to_datetime(frame.index, unit='ms')
-            frame = frame.astype(float)
+            frame = frame.drop_duplicates(subset='time', keep='last').set_index('time')
+            frame.index = pd.to_datetime(frame.index.astype('int64'), unit='ms')
+            frame = frame.astype(self.__dtype)
             return frame
 
     def __set_data_merge(self, li: list) -> pd.DataFrame:
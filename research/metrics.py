@@ -1,24 +1,85 @@
 import pandas as pd
 import numpy as np
-import statsmodels.api as sm
+from research.cache import ResultCache
+from research.cleaner import get_validity_index, get_pair_windows, get_window_groups
+
+METRICS_METHODS = ('batch', 'exact')
+
+# Max number of floats held by the spreads of a block of pairs
+BLOCK_SIZE = 2 ** 22
 
 
 class Metrics:
-    def __init__(self, cleaned_df: pd.DataFrame):
+    def __init__(self, cleaned_df: pd.DataFrame, method: str = 'batch', cache: ResultCache = None):
+        """
+        :param method: 'batch' computes every hedge ratio and zero crossing at once with NumPy,
+        'exact' fits a statsmodels OLS for each pair
+        :type: str
+
+        :param cache: cached hedge ratios and zero crossings, so only the pairs with new prices are fitted
+        :type: ResultCache
+        """
+        assert method in METRICS_METHODS, f'Method "{method}" must by one of {list(METRICS_METHODS)}'
+
         self.cleaned_df = cleaned_df
         self.output_df = pd.DataFrame()
+        self.__method = method
+        self.__cache = cache
 
     def apply_metrics(self, coint_df: pd.DataFrame):
-        (ratio, zero_crossings) = np.vectorize(
-            self.__metrics_by_pairs)(coint_df['currency1'], coint_df['currency2'])
+        (currencies1, currencies2) = (coint_df['currency1'], coint_df['currency2'])
+        if self.__cache is None:
+            (ratio, zero_crossings) = self.__get_metrics(currencies1, currencies2)
+        else:
+            keys = self.__cache.get_keys('metrics', self.cleaned_df.to_numpy(),
+                                         self.cleaned_df.columns.get_indexer(currencies1),
+                                         self.cleaned_df.columns.get_indexer(currencies2), method=self.__method)
+            (ratio, zero_crossings) = self.__cache.get_or_compute(
+                'metrics', keys, list(currencies1), list(currencies2),
+                lambda missing: self.__get_metrics(currencies1.iloc[missing], currencies2.iloc[missing]))
 
         coint_df['ratio'] = ratio
         coint_df['zero_crossings'] = zero_crossings
         self.output_df = coint_df
         return self
 
+    def __get_metrics(self, currencies1: pd.Series, currencies2: pd.Series) -> tuple:
+        if self.__method == 'batch':
+            return self.__batch_metrics(currencies1, currencies2)
+        if len(currencies1) == 0:
+            return np.empty(0), np.empty(0, dtype=int)
+        return np.vectorize(self.__metrics_by_pairs)(currencies1, currencies2)
+
+    def __batch_metrics(self, currencies1: pd.Series, currencies2: pd.Series):
+        """
+        Hedge ratio and zero crossings of every pair over its overlapping bars, the pairs sharing the same
+        bars being computed at once.
+        """
+        values = self.cleaned_df.to_numpy()
+        positions1 = self.cleaned_df.columns.get_indexer(currencies1)
+        positions2 = self.cleaned_df.columns.get_indexer(currencies2)
+        starts, ends = get_pair_windows(get_validity_index(self.cleaned_df), positions1, positions2)
+
+        ratio = np.empty(len(positions1))
+        zero_crossings = np.empty(len(positions1), dtype=int)
+        for (start, end, window_pairs) in get_window_groups(starts, ends):
+            block = max(1, BLOCK_SIZE // max(1, end - start))
+            for i in range(0, len(window_pairs), block):
+                pairs = window_pairs[i:i + block]
+                series1 = values[start:end, positions1[pairs]].astype(float)
+                series2 = values[start:end, positions2[pairs]].astype(float)
+
+                # No intercept OLS of series1 on series2
+                ratio[pairs] = np.einsum('tp,tp->p', series1, series2) / np.einsum('tp,tp->p', series2, series2)
+                spreads = self.__calculate_spread(series1, series2, ratio[pairs])
+                zero_crossings[pairs] = np.count_nonzero(np.diff(np.sign(spreads), axis=0), axis=0)
+
+        return ratio, zero_crossings
+
     def __metrics_by_pairs(self, currency1, currency2):
-        (series1, series2) = (self.cleaned_df[currency1], self.cleaned_df[currency2])
+        # Each pair only uses its overlapping bars
+        pair_df = self.cleaned_df[[currency1, currency2]].dropna()
+        (series1, series2) = (pair_df[currency1], pair_df[currency2])
 
         ratio = self.__set_hedge_ratio(series1, series2)
         zero_crossings = self.__get_zero_crossings(series1, series2, ratio)
@@ -27,6 +88,7 @@ class Metrics:
 
     @staticmethod
     def __set_hedge_ratio(series1, series2):
+        import statsmodels.api as sm
         model = sm.OLS(series1, series2).fit()
         return model.params[0]
 
@@ -0,0 +1,109 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+class PanelStore:
+    """
+    Columnar storage of a (symbol, field) multi-index OHLCV panel, as one (time, symbol) float array per
+    field, ./<field>.npy, along with ./time.npy in epoch milliseconds and ./symbols.json.
+    """
+
+    def __init__(self, directory: str = './data/raw/historical_data') -> None:
+        self.directory = directory
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, 'symbols.json'))
+
+    def save(self, hist_df: pd.DataFrame, dtype=None) -> None:
+        """
+        Saves the panel merged into the stored one when both have the same times, so a panel loaded with
+        only some fields or symbols keeps the other ones. A panel of other times replaces the stored one.
+
+        :param dtype: dtype of the stored values, e.g. np.float32, the panel one by default
+        """
+        symbols = list(hist_df.columns.get_level_values(0).unique())
+        fields = list(hist_df.columns.get_level_values(1).unique())
+        times = pd.DatetimeIndex(pd.to_datetime(hist_df.index)).as_unit('ms').asi8
+        os.makedirs(self.directory, exist_ok=True)
+
+        meta = self.__get_meta() if self.exists() else None
+        if meta is not None and not np.array_equal(np.load(self.__get_path('time')), times):
+            meta = None
+        (stored_symbols, stored_fields) = ([], []) if meta is None else (meta['symbols'], meta['fields'])
+        all_symbols = stored_symbols + [symbol for symbol in symbols if symbol not in stored_symbols]
+        all_fields = stored_fields + [field for field in fields if field not in stored_fields]
+        positions = pd.Index(all_symbols).get_indexer(symbols)
+
+        for field in all_fields:
+            if field not in fields and len(all_symbols) == len(stored_symbols):
+                continue
+
+            # The stored values are copied before they are replaced, as hist_df may map them
+            stored = np.load(self.__get_path(field), mmap_mode='r') if field in stored_fields else None
+            field_df = hist_df.xs(field, axis=1, level=1).reindex(columns=symbols) if field in fields else None
+            field_dtype = dtype or np.result_type(*([] if stored is None else [stored.dtype]),
+                                                  *([] if field_df is None else field_df.dtypes), np.float32)
+
+            values = np.full((len(times), len(all_symbols)), np.nan, dtype=field_dtype)
+            if stored is not None:
+                values[:, :len(stored_symbols)] = stored
+            if field_df is not None:
+                values[:, positions] = field_df.to_numpy(dtype=field_dtype)
+            del stored
+            self.__save(self.__get_path(field), lambda path: np.save(path, values))
+
+        self.__save(self.__get_path('time'), lambda path: np.save(path, times))
+        self.__save(os.path.join(self.directory, 'symbols.json'),
+                    lambda path: self.__write_json(path, {'symbols': all_symbols, 'fields': all_fields}))
+
+    def __get_path(self, name: str) -> str:
+        return os.path.join(self.directory, f'{name}.npy')
+
+    def __get_meta(self) -> dict:
+        with open(os.path.join(self.directory, 'symbols.json')) as file:
+            return json.load(file)
+
+    @staticmethod
+    def __write_json(path: str, value: dict) -> None:
+        with open(path, 'w') as file:
+            json.dump(value, file)
+
+    @staticmethod
+    def __save(path: str, write) -> None:
+        """
+        Writes a new file moved in place, so the memory maps of the previous one stay valid.
+        """
+        (root, extension) = os.path.splitext(path)
+        temporary_path = f'{root}.tmp{extension}'
+        write(temporary_path)
+        os.replace(temporary_path, path)
+
+    def load(self, fields: list = None, symbols: list = None) -> pd.DataFrame:
+        """
+        Memory maps the stored fields, so a single field of all symbols is loaded without copies.
+
+        :param fields: projected fields, e.g. ['close'], all of them by default
+        :type: list
+
+        :param symbols: projected symbols, all of them by default
+        :type: list
+        """
+        meta = self.__get_meta()
+        fields = meta['fields'] if fields is None else list(fields)
+        positions = slice(None) if symbols is None else \
+            pd.Index(meta['symbols']).get_indexer(symbols)
+        symbols = meta['symbols'] if symbols is None else list(symbols)
+        assert not isinstance(positions, np.ndarray) or (positions >= 0).all(), 'Unknown symbols'
+
+        index = pd.to_datetime(np.load(self.__get_path('time')), unit='ms')
+        frames = [pd.DataFrame(np.load(self.__get_path(field), mmap_mode='r')[:, positions],
+                               index=index, columns=pd.MultiIndex.from_product([symbols, [field]]), copy=False)
+                  for field in fields]
+
+        if len(frames) == 1:
+            return frames[0]
+
+        # Several fields are interleaved by symbol, as the panels built by Loader
+        return pd.concat(frames, axis=1).reindex(columns=pd.MultiIndex.from_product([symbols, fields]))
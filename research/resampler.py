@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+# Seconds of each timeframe unit, as ccxt parse_timeframe
+TIMEFRAME_SECONDS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'M': 2592000, 'y': 31536000}
+
+# Weekly candles open on Mondays, and the epoch was a Thursday
+WEEK_OFFSET_MS = 4 * 86400 * 1000
+
+
+def parse_timeframe(timeframe: str) -> tuple:
+    """
+    Returns the (amount, unit) of a timeframe, e.g. (4, 'h') for '4h'.
+    """
+    amount, unit = timeframe[:-1], timeframe[-1]
+    assert unit in TIMEFRAME_SECONDS and amount.isdigit() and int(amount) > 0, f'Unknown timeframe "{timeframe}"'
+    return int(amount), unit
+
+
+def get_bucket_starts(times: np.ndarray, timeframe: str) -> np.ndarray:
+    """
+    Returns the open time, in epoch milliseconds, of the candle of the given timeframe holding each
+    time, with candles aligned as on the exchanges: on the epoch for fixed timeframes, on Mondays for
+    weeks, and on calendar months and years.
+    """
+    amount, unit = parse_timeframe(timeframe)
+    times = np.asarray(times, dtype=np.int64)
+
+    if unit in 'My':
+        calendar_unit = f'datetime64[{unit.upper()}]'
+        calendar = times.astype('datetime64[ms]').astype(calendar_unit).astype(np.int64)
+        return (calendar - calendar % amount).astype(calendar_unit).astype('datetime64[ms]').astype(np.int64)
+
+    step = amount * TIMEFRAME_SECONDS[unit] * 1000
+    offset = WEEK_OFFSET_MS if unit == 'w' else 0
+    return (times - offset) // step * step + offset
+
+
+class Resampler:
+    """
+    Derives the OHLCV panels of coarser timeframes from a single base resolution panel, with
+    vectorized first/max/min/last/sum aggregations, and keeps every derived panel.
+    """
+
+    def __init__(self, base_df: pd.DataFrame, base_timeframe: str) -> None:
+        """
+        :param base_df: (symbol, field) multi-index OHLCV panel of the base resolution
+        :type: pd.DataFrame
+
+        :param base_timeframe: e.g. '1m', '15m'
+        :type: str
+        """
+        self.base_df = base_df
+        self.base_timeframe = base_timeframe
+        self.__times = pd.DatetimeIndex(pd.to_datetime(base_df.index)).as_unit('ms').asi8
+        self.__frames = {base_timeframe: base_df}
+
+    def resample(self, timeframe: str) -> pd.DataFrame:
+        if timeframe not in self.__frames:
+            self.__frames[timeframe] = self.__resample(timeframe)
+        return self.__frames[timeframe]
+
+    def __resample(self, timeframe: str) -> pd.DataFrame:
+        self.__check_timeframe(timeframe)
+        bucket_starts = get_bucket_starts(self.__times, timeframe)
+
+        # Candles starting before the base data would be partial, as the exchange would not return them
+        is_kept = bucket_starts >= self.__times[0] if len(self.__times) > 0 else np.ones(0, dtype=bool)
+        bucket_starts = bucket_starts[is_kept]
+        starts = np.flatnonzero(np.diff(bucket_starts, prepend=np.int64(-1)))
+
+        index = pd.to_datetime(bucket_starts[starts], unit='ms')
+        frames = []
+        for field in self.base_df.columns.get_level_values(1).unique():
+            field_df = self.base_df.xs(field, axis=1, level=1)
+            values = field_df.to_numpy()[is_kept]
+            frames.append(pd.DataFrame(self.__aggregate(values, starts, field), index=index,
+                                       columns=pd.MultiIndex.from_product([field_df.columns, [field]])))
+
+        return pd.concat(frames, axis=1).reindex(columns=self.base_df.columns)
+
+    @staticmethod
+    def __aggregate(values: np.ndarray, starts: np.ndarray, field: str) -> np.ndarray:
+        """
+        Aggregates the (bars, symbols) values of a field over the buckets beginning at starts, ignoring
+        the missing bars, and NaN for the buckets without any bar.
+        """
+        if len(starts) == 0:
+            return np.empty((0, values.shape[1]), dtype=values.dtype)
+
+        is_valid = ~np.isnan(values)
+        if field == 'high':
+            return np.fmax.reduceat(values, starts, axis=0)
+        if field == 'low':
+            return np.fmin.reduceat(values, starts, axis=0)
+        if field == 'volume':
+            counts = np.add.reduceat(is_valid, starts, axis=0)
+            return np.where(counts > 0, np.add.reduceat(np.where(is_valid, values, 0), starts, axis=0), np.nan)
+
+        rows = np.arange(len(values)).reshape(-1, 1)
+        if field == 'open':
+            positions = np.minimum.reduceat(np.where(is_valid, rows, len(values)), starts, axis=0)
+        else:
+            positions = np.maximum.reduceat(np.where(is_valid, rows, -1), starts, axis=0)
+        has_value = (positions >= 0) & (positions < len(values))
+        aggregated = np.take_along_axis(values, np.clip(positions, 0, len(values) - 1), axis=0)
+        return np.where(has_value, aggregated, np.nan)
+
+    def __check_timeframe(self, timeframe: str) -> None:
+        (base_amount, base_unit) = parse_timeframe(self.base_timeframe)
+        (amount, unit) = parse_timeframe(timeframe)
+        base_seconds = base_amount * TIMEFRAME_SECONDS[base_unit]
+
+        # Calendar candles are made of whole days, which the base candles must divide
+        seconds = 86400 if unit in 'My' else amount * TIMEFRAME_SECONDS[unit]
+        assert base_unit not in 'My' and seconds % base_seconds == 0, \
+            f'Timeframe "{timeframe}" can not be derived from "{self.base_timeframe}"'
@@ -1,22 +1,76 @@
-from research import Loader
+from research import CandleStore
 from research import Cleaner
 from research import Correlation
+from research.correlation import CHUNK_ROWS
 from research import Cointegration
 from research import Metrics
+from research import PanelStore
+from research import IncrementalResearch
+from research import Instrumentation
+from research import ResultCache
+from research import Resampler
+from research import ClusterIndex
 
 import pandas as pd
+import numpy as np
 
 
 class Researcher:
-    def __init__(self) -> None:
+    def __init__(self, instrumentation: Instrumentation = None, cache: ResultCache = None,
+                 compact: bool = False, cluster_index: ClusterIndex = None, min_overlap: int = None) -> None:
+        """
+        :param instrumentation: records the timings, memory and cardinalities of the research stages
+        :type: Instrumentation
+
+        :param cache: cached per pair results, so only the pairs with new prices are tested again
+        :type: ResultCache
+
+        :param compact: hold the prices as float32 and compute the correlations chunk by chunk, while
+        every statistic is still accumulated in float64
+        :type: bool
+
+        :param cluster_index: prefilter screening only the pairs of symbols of the same or of neighbouring
+        clusters, or None to screen all pairs
+        :type: ClusterIndex
+
+        :param min_overlap: research the symbols listed during the interval too, each pair over its own
+        overlapping bars if it has at least min_overlap of them, or None to drop the symbols missing any bar
+        :type: int
+        """
         self.hist_df = pd.DataFrame()
         self.output_df = pd.DataFrame()
+        self.__incremental = None
+        self.__resamplers = {}
+        self.instrumentation = instrumentation or Instrumentation(enabled=False)
+        self.cache = cache
+        self.compact = compact
+        self.cluster_index = cluster_index
+        self.min_overlap = min_overlap
+        self.__dtype = np.float32 if compact else np.float64
+
+    def load_research(self, fields: tuple = ('close',), symbols: list = None, csv: bool = False) -> None:
+        """
+        :param fields: OHLCV fields to load, e.g. ('close',) or None for all of them
+        :type: tuple
+
+        :param symbols: symbols to load, or None for all of them
+        :type: list
+
+        :param csv: load the CSV historical data, used anyway when there is no columnar one
+        :type: bool
+        """
+        panel = PanelStore()
+        if csv or not panel.exists():
+            self.hist_df = pd.read_csv('./data/raw/historical_data.csv', header=[0, 1], index_col=0,
+                                       dtype=self.__dtype)
+        else:
+            hist_df = panel.load(fields=fields, symbols=symbols)
+            self.hist_df = hist_df if (hist_df.dtypes == self.__dtype).all() else hist_df.astype(self.__dtype)
 
-    def load_research(self) -> None:
-        self.hist_df = pd.read_csv('./data/raw/historical_data.csv', header=[0, 1], index_col=0)
         self.output_df = pd.read_csv('./data/outputs/researcher.csv', index_col=0)
 
-    def new_research(self, exchange: str, timeframe: str, interval: str, min_correlation: float) -> None:
+    def new_research(self, exchange: str, timeframe: str, interval: str, min_correlation: float,
+                     concurrent: bool = False, store: CandleStore = None, base_timeframe: str = None) -> None:
         """
         :param exchange: e.g. 'binance', 'kucoin', 'bybit'
         :type: str
@@ -29,18 +83,114 @@ class Researcher:
 
         :param min_correlation: e.g. '0.83' is 83%
         :type: float
+
+        :param concurrent: download the historical data concurrently
+        :type: bool
+
+        :param store: local candles, so only new candles are downloaded
+        :type: CandleStore
+
+        :param base_timeframe: finer timeframe downloaded once, e.g. '15m', from which this and the next
+        researches of the same exchange and interval aggregate their timeframe locally
+        :type: str
         """
-        raw_df = Loader(exchange).new_historical_data(timeframe=timeframe, interval=interval)
-        self.hist_df = Cleaner().fill_missing_data(raw_df)
+        with self.instrumentation.stage('loader') as record:
+            if base_timeframe is None:
+                raw_df = self.__get_loader(exchange, store).new_historical_data(
+                    timeframe=timeframe, interval=interval, concurrent=concurrent)
+            else:
+                raw_df = self.__get_resampler(exchange, base_timeframe, interval, concurrent, store
+                                              ).resample(timeframe)
+            record['n_out'] = raw_df.columns.get_level_values(0).nunique()
+        with self.instrumentation.stage('fill_missing_data', n_in=record['n_out']) as record:
+            self.hist_df = Cleaner().fill_missing_data(raw_df)
+            record['n_out'] = len(self.hist_df)
         self.__set_dataframes(min_correlation=min_correlation)
 
+    def refresh_research(self, exchange: str, timeframe: str, interval: str, min_correlation: float,
+                         tolerance: float = 0.01, concurrent: bool = False, store: CandleStore = None,
+                         base_timeframe: str = None) -> None:
+        """
+        Same as new_research, but only updates the correlations and hedge ratios with the bars changed
+        since the last refresh, and only tests again the cointegration of the pairs that moved.
+        The base timeframe, if any, is always downloaded again. The symbols missing any bar are
+        dropped, so it does not support min_overlap nor cluster_index.
+
+        :param tolerance: absolute correlation change, or relative hedge ratio change, above which the
+        cointegration of a pair is tested again
+        :type: float
+        """
+        assert self.min_overlap is None and self.cluster_index is None, \
+            'The refreshed research must be of the symbols with all bars, without min_overlap nor cluster_index'
+
+        if base_timeframe is None:
+            raw_df = self.__get_loader(exchange, store).new_historical_data(
+                timeframe=timeframe, interval=interval, concurrent=concurrent)
+        else:
+            self.__resamplers.pop((exchange, base_timeframe, interval), None)
+            raw_df = self.__get_resampler(exchange, base_timeframe, interval, concurrent, store).resample(timeframe)
+        self.hist_df = Cleaner().fill_missing_data(raw_df)
+
+        if self.__incremental is None or self.__incremental.min_correlation != min_correlation:
+            self.__incremental = IncrementalResearch(min_correlation=min_correlation, tolerance=tolerance,
+                                                     cache=self.cache)
+
+        self.__incremental.tolerance = tolerance
+        self.output_df = self.__incremental.update(Cleaner().get_cleaned_data(self.hist_df))
+
+    def __get_loader(self, exchange: str, store: CandleStore):
+        # ccxt is only imported by the researches that download data
+        from research import Loader
+        return Loader(exchange, store=store, dtype=self.__dtype)
+
+    def __get_resampler(self, exchange: str, base_timeframe: str, interval: str, concurrent: bool,
+                        store: CandleStore) -> Resampler:
+        key = (exchange, base_timeframe, interval)
+        if key not in self.__resamplers:
+            self.__resamplers[key] = self.__get_loader(exchange, store).new_resampler(base_timeframe, interval,
+                                                                                     concurrent)
+        return self.__resamplers[key]
+
     def __set_dataframes(self, min_correlation: float):
-        cleaned_df = Cleaner().get_cleaned_data(self.hist_df)
-        corr_df = Correlation(cleaned_df).get_log_correlation(min_correlation=min_correlation)
-        coint_df = Cointegration(cleaned_df).filter_by_cointegration(corr_df).get_results()
-        output_df = Metrics(cleaned_df).apply_metrics(coint_df).filter_by_crossings().get_results()
+        instrumentation = self.instrumentation
+        with instrumentation.stage('cleaner', n_in=self.hist_df.columns.get_level_values(0).nunique()) as record:
+            cleaner = Cleaner(min_overlap=self.min_overlap)
+            cleaned_df = cleaner.get_cleaned_data(self.hist_df)
+            record['n_out'] = cleaned_df.shape[1]
+        candidates = None if self.min_overlap is None else cleaner.get_overlap_mask()
+        if self.cluster_index is not None:
+            with instrumentation.stage('prefilter', n_in=cleaned_df.shape[1]) as record:
+                cluster_candidates = self.cluster_index.fit(cleaned_df).candidates
+                candidates = cluster_candidates if candidates is None else cluster_candidates & candidates
+                record['n_out'] = int(np.count_nonzero(candidates)) // 2
+        with instrumentation.stage('correlation', n_in=cleaned_df.shape[1]) as record:
+            corr_df = Correlation(cleaned_df, chunk_rows=CHUNK_ROWS if self.compact else None, candidates=candidates
+                                  ).get_log_correlation(min_correlation=min_correlation)
+            record['n_out'] = len(corr_df)
+        with instrumentation.stage('cointegration', n_in=len(corr_df)) as record:
+            coint_df = Cointegration(cleaned_df, cache=self.cache).filter_by_cointegration(corr_df).get_results()
+            record['n_out'] = len(coint_df)
+        with instrumentation.stage('metrics', n_in=len(coint_df)) as record:
+            output_df = Metrics(cleaned_df, cache=self.cache).apply_metrics(coint_df).filter_by_crossings(
+                ).get_results()
+            record['n_out'] = len(output_df)
         self.output_df = output_df
 
-    def save_outputs(self):
-        self.hist_df.to_csv('./data/raw/historical_data.csv', index=True)
+    def get_memory_usage(self) -> dict:
+        """
+        Returns the bytes of the historical data, and the bytes saved against float64 prices.
+        """
+        n_bytes = int(self.hist_df.memory_usage(index=True).sum())
+        float64_bytes = n_bytes + int(sum((8 - dtype.itemsize) * len(self.hist_df) for dtype in self.hist_df.dtypes))
+        return {'bytes': n_bytes, 'float64_bytes': float64_bytes, 'saved_bytes': float64_bytes - n_bytes,
+                'saved_percent': round(100 * (1 - n_bytes / float64_bytes), 2) if float64_bytes else 0.0}
+
+    def save_outputs(self, csv: bool = False):
+        """
+        :param csv: also export the historical data as CSV
+        :type: bool
+        """
+        PanelStore().save(self.hist_df)
+        if csv:
+            self.hist_df.to_csv('./data/raw/historical_data.csv', index=True)
         self.output_df.to_csv('./data/outputs/researcher.csv')
@@ -0,0 +1,6 @@
+"""Batch Research and Backtest Runner
+
+Run the research and backtests of every exchange, timeframe, interval and threshold of a job spec
+with ``python -m runner.run --spec jobs.json``, see ``python -m runner.run --help``.
+
+"""
@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from itertools import product
+import pandas as pd
+import numpy as np
+from backtest import metrics
+
+# Keys of a job spec and their defaults. Every combination of the exchanges, timeframes, intervals and
+# min_correlations is a job, and each job backtests all (open_at, close_at) thresholds
+SPEC_DEFAULTS = {'exchanges': ['binance'],
+                 'timeframes': ['1d'],
+                 'intervals': ['1 year ago'],
+                 'min_correlations': [0.51],
+                 'thresholds': [[2, 0]],
+                 'window': metrics.Z_SCORE_WINDOW,
+                 'spread_model': 'ols',
+                 'base_timeframe': None,
+                 'min_overlap': None,
+                 'concurrent': False,
+                 'min_sharperatio': 4,
+                 'max_drawdown': 20}
+
+JOB_KEYS = ['exchange', 'timeframe', 'interval', 'min_correlation']
+
+BOT_INPUT_COLUMNS = ['currency1', 'currency2', 'ratio', 'timeframe', 'exchange', 'interval', 'min_correlation',
+                     'open_at', 'close_at', 'sharperatio', 'max_drawdown', 'roi', 'n_trades']
+
+# Spec keys the job results depend on, recorded in their done file
+RESULT_KEYS = ['thresholds', 'window', 'spread_model', 'base_timeframe', 'min_overlap']
+
+# Written last in each job directory, so the jobs without it run again on resume
+DONE_FILE = 'done.json'
+
+
+def load_spec(path: str) -> dict:
+    with open(path) as file:
+        spec = json.load(file)
+
+    unknown = set(spec) - set(SPEC_DEFAULTS)
+    assert not unknown, f'Unknown spec keys {sorted(unknown)}, they must by one of {list(SPEC_DEFAULTS)}'
+    return {**SPEC_DEFAULTS, **spec}
+
+
+def get_jobs(spec: dict) -> list:
+    """
+    Returns every (exchange, timeframe, interval, min_correlation) job of the spec, with its id.
+    """
+    jobs = [dict(zip(JOB_KEYS, values)) for values in product(spec['exchanges'], spec['timeframes'],
+                                                             spec['intervals'], spec['min_correlations'])]
+    for job in jobs:
+        job['id'] = re.sub(r'[^A-Za-z0-9.]+', '-', '_'.join(str(job[key]) for key in JOB_KEYS))
+    return jobs
+
+
+def get_settings(spec: dict) -> dict:
+    return {key: spec[key] for key in RESULT_KEYS}
+
+
+def is_done(directory: str, job: dict, spec: dict) -> bool:
+    """
+    Whether the job is done with the settings of the spec, so the jobs done with other settings run again.
+    """
+    path = os.path.join(directory, job['id'], DONE_FILE)
+    if not os.path.exists(path):
+        return False
+
+    with open(path) as file:
+        settings = json.load(file).get('settings')
+    # Compared through JSON, as the thresholds tuples are stored as lists
+    return settings == json.loads(json.dumps(get_settings(spec)))
+
+
+def _write_atomic(path: str, write) -> None:
+    """
+    Writes a file through write(temporary_path), then moves it in place, so a crash never leaves a
+    partial file.
+    """
+    temporary_path = f'{path}.tmp'
+    write(temporary_path)
+    os.replace(temporary_path, path)
+
+
+def _write_json(path: str, value: dict) -> None:
+    with open(path, 'w') as file:
+        json.dump(value, file, indent=2)
+
+
+def _run_group(jobs: list, spec: dict, directory: str, store_directory: str, cache_path: str) -> list:
+    """
+    Runs the jobs of the same exchange and downloaded timeframe one after the other in one process,
+    so only this process writes their candles, and the next jobs find them in the shared store. The
+    store never evicts here, as it would remove the candles other processes are reading; run_batch
+    evicts once all groups are done.
+    Returns the (job id, error) of every job, without error when it is done.
+    """
+    # The packages are imported in the processes that run jobs only
+    from research import CandleStore
+    from research import Researcher
+    from research import ResultCache
+
+    store = CandleStore(store_directory, max_bytes=None)
+    research = Researcher(cache=ResultCache(cache_path) if cache_path else None, min_overlap=spec['min_overlap'])
+
+    outcomes = []
+    for job in jobs:
+        try:
+            run_job(job, spec, research, store, directory)
+            outcomes.append((job['id'], None))
+        except Exception:
+            error = traceback.format_exc()
+            with open(os.path.join(directory, job['id'], 'error.txt'), 'w') as file:
+                file.write(error)
+            outcomes.append((job['id'], error))
+    return outcomes
+
+
+def run_job(job: dict, spec: dict, research, store, directory: str) -> None:
+    """
+    Researches the pairs of a job and backtests them for every threshold of the spec, into the
+    researcher.csv and backtester.csv of its own directory.
+    """
+    from backtest import Backtester
+
+    start = time.perf_counter()
+    job_directory = os.path.join(directory, job['id'])
+    os.makedirs(job_directory, exist_ok=True)
+
+    research.new_research(exchange=job['exchange'], timeframe=job['timeframe'], interval=job['interval'],
+                          min_correlation=job['min_correlation'], concurrent=spec['concurrent'], store=store,
+                          base_timeframe=spec['base_timeframe'])
+    _write_atomic(os.path.join(job_directory, 'researcher.csv'), research.output_df.to_csv)
+
+    backtester = Backtester(research)
+    results = []
+    for open_at, close_at in spec['thresholds']:
+        backtester.edit_settings(open_at=open_at, close_at=close_at, window=spec['window'],
+                                 spread_model=spec['spread_model'])
+        backtester.run_backtests()
+        results_df = backtester.results_df.copy()
+        (results_df['open_at'], results_df['close_at']) = (open_at, close_at)
+        results.append(results_df)
+
+    backtest_df = pd.concat(results, ignore_index=True)
+    for key in JOB_KEYS:
+        backtest_df[key] = job[key]
+    _write_atomic(os.path.join(job_directory, 'backtester.csv'), lambda path: backtest_df.to_csv(path, index=False))
+
+    done = {'job': job, 'settings': get_settings(spec), 'n_researched': len(research.output_df), 'n_backtested': len(backtest_df),
+            'seconds': time.perf_counter() - start, 'date': datetime.now().isoformat()}
+    _write_atomic(os.path.join(job_directory, DONE_FILE), lambda path: _write_json(path, done))
+    if os.path.exists(os.path.join(job_directory, 'error.txt')):
+        os.remove(os.path.join(job_directory, 'error.txt'))
+
+
+def run_batch(spec: dict, directory: str, store_directory: str = './data/raw/candles', cache_path: str = None,
+              processes: int = None, force: bool = False, max_bytes: int = 2 ** 30) -> dict:
+    """
+    Runs the jobs of the spec that are not done yet across a process pool, the jobs downloading the
+    same candles in the same process, and returns the error of each failed job by id.
+
+    :param force: run the done jobs again
+    :type: bool
+
+    :param max_bytes: size of the candle store above which the least recently used timeframes are
+    evicted after the jobs, except the ones of the spec
+    :type: int
+    """
+    os.makedirs(directory, exist_ok=True)
+    pending = [job for job in get_jobs(spec) if force or not is_done(directory, job, spec)]
+    for job in pending:
+        os.makedirs(os.path.join(directory, job['id']), exist_ok=True)
+
+    groups = {}
+    for job in pending:
+        groups.setdefault((job['exchange'], spec['base_timeframe'] or job['timeframe']), []).append(job)
+    tasks = [(jobs, spec, directory, store_directory, cache_path) for jobs in groups.values()]
+
+    errors = {}
+    if processes == 1 or len(tasks) <= 1:
+        outcomes = [outcome for task in tasks for outcome in _run_group(*task)]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_run_group, *task) for task in tasks]
+            outcomes = [outcome for future in as_completed(futures) for outcome in future.result()]
+
+    if groups:
+        from research import CandleStore
+        CandleStore(store_directory, max_bytes=max_bytes).evict(keep=tuple(groups))
+
+    for job_id, error in outcomes:
+        print(f"{job_id}: {'failed' if error else 'done'}")
+        if error:
+            errors[job_id] = error
+    return errors
+
+
+def merge_results(spec: dict, directory: str) -> pd.DataFrame:
+    """
+    Merges the backtests of the done jobs of the spec into the bot input: the pairs above
+    min_sharperatio and below max_drawdown, ranked by sharpe ratio, where each currency of an exchange
+    is only traded by its best pair.
+    """
+    done_jobs = [job for job in get_jobs(spec) if is_done(directory, job, spec)]
+    if len(done_jobs) < len(get_jobs(spec)):
+        print(f'{len(get_jobs(spec)) - len(done_jobs)} jobs are not done with the settings of the spec, '
+              f'so they are not merged')
+    frames = [pd.read_csv(os.path.join(directory, job['id'], 'backtester.csv')) for job in done_jobs]
+    backtest_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=BOT_INPUT_COLUMNS)
+
+    ranked_df = backtest_df[(backtest_df['sharperatio'] >= spec['min_sharperatio']) &
+                            (backtest_df['max_drawdown'] <= spec['max_drawdown'])
+                            ].sort_values(by='sharperatio', ascending=False, kind='stable')
+
+    (used, is_kept) = (set(), [])
+    for exchange, currency1, currency2 in zip(ranked_df['exchange'], ranked_df['currency1'], ranked_df['currency2']):
+        is_kept.append((exchange, currency1) not in used and (exchange, currency2) not in used)
+        if is_kept[-1]:
+            used.update([(exchange, currency1), (exchange, currency2)])
+
+    bot_input_df = ranked_df[np.array(is_kept, dtype=bool)][BOT_INPUT_COLUMNS].reset_index(drop=True)
+    _write_atomic(os.path.join(directory, 'bot_input.csv'), lambda path: bot_input_df.to_csv(path, index=False))
+    return bot_input_df
+
+
+def main(args: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Runs the research and backtests of a job spec, resuming from the '
+                                                 'done jobs, and merges them into a ranked bot_input.csv.')
+    parser.add_argument('--spec', required=True, help=f'JSON job spec, with the keys {list(SPEC_DEFAULTS)}')
+    parser.add_argument('--output-dir', default='./data/outputs/batch', help='directory of the job outputs')
+    parser.add_argument('--store', default='./data/raw/candles', help='directory of the shared candles')
+    parser.add_argument('--max-bytes', type=int, default=2 ** 30,
+                        help='size of the candle store above which the least recently used timeframes are evicted')
+    parser.add_argument('--cache', default=None, help='SQLite file of the shared per pair results, if any')
+    parser.add_argument('--processes', type=int, default=None, help='all cpus by default')
+    parser.add_argument('--force', action='store_true', help='run the done jobs again')
+    parser.add_argument('--merge-only', action='store_true', help='only merge the done jobs')
+    options = parser.parse_args(args)
+
+    spec = load_spec(options.spec)
+    errors = {}
+    if not options.merge_only:
+        errors = run_batch(spec, options.output_dir, options.store, options.cache, options.processes, options.force,
+                           options.max_bytes)
+
+    bot_input_df = merge_results(spec, options.output_dir)
+    print(f"{len(bot_input_df)} pairs in {os.path.join(options.output_dir, 'bot_input.csv')}")
+    if errors:
+        print(f"FAILED {', '.join(errors)}, see their error.txt")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())